@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# GitMon - The Git Repository Monitor
+# Copyright (C) 2010  Tomas Varaneckas
+# http://www.varaneckas.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks Gitmon.check against a synthetic fleet of local repositories.
+#
+# Every repository gets a bare "origin", a work clone that produces activity
+# and a monitored clone under a scanned root. Between check cycles each work
+# clone pushes new commits to every branch and new tags. Timings of each
+# phase are taken from the metrics gitmon records for each repository and
+# summed over all repositories, so with check.parallelism above 1 (or with
+# check.backend = subprocess, where checks interleave) they may add up to
+# more than the cycle itself.
+# Everything runs offline, notifications go to the null notifier.
+#
+# usage: python bench/fleet.py [options], see --help
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'lib'))
+
+from gitmon import gitmon
+from gitmon.metrics import Metrics
+
+phases = ('fetch', 'diff', 'stats', 'format', 'notify')
+
+class PhaseTimer(Metrics):
+    """Metrics of Gitmon.check that sum <phase>_seconds of all repositories
+    when a cycle is written"""
+
+    def __init__(self):
+        Metrics.__init__(self)
+        self.reset()
+
+    def reset(self):
+        self.times = dict([(phase, 0.0) for phase in phases])
+
+    def write(self):
+        with self.lock:
+            for repo in self.repos.values():
+                for phase in phases:
+                    self.times[phase] += repo.values.get('%s_seconds' % phase, 0)
+        Metrics.write(self)
+
+def git(*args, **kwargs):
+    subprocess.check_call(('git',) + args, stdout=open(os.devnull, 'w'),
+                          stderr=subprocess.STDOUT, **kwargs)
+
+def fast_import(work, stream):
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=work,
+                            stdin=subprocess.PIPE)
+    proc.communicate(stream)
+    if proc.returncode:
+        raise Exception('git fast-import failed in %s' % work)
+
+def data(text):
+    return 'data %s\n%s\n' % (len(text), text)
+
+def commit_stream(branches, commits, files, cycle, tags):
+    """Returns fast-import stream adding commits to every branch and tags"""
+    out = []
+    now = int(time.time())
+    for branch in branches:
+        for n in range(commits):
+            out.append('commit refs/heads/%s\n' % branch)
+            out.append('committer bench <bench@localhost> %s +0000\n' % now)
+            out.append(data('cycle %s, %s commit %s' % (cycle, branch, n)))
+            if n == 0 and cycle > 0:
+                out.append('from refs/heads/%s^0\n' % branch)
+            for f in range(files):
+                out.append('M 100644 inline %s/file%s\n' % (branch, f))
+                out.append(data('%s %s %s\n' % (cycle, n, f)))
+            out.append('\n')
+    for t in range(tags):
+        out.append('tag cycle%s-%s\nfrom refs/heads/%s\n' % (cycle, t, branches[0]))
+        out.append('tagger bench <bench@localhost> %s +0000\n' % now)
+        out.append(data('tag %s of cycle %s' % (t, cycle)))
+    return ''.join(out)
+
+def push(work):
+    git('push', '--quiet', 'origin', 'refs/heads/*:refs/heads/*', 'refs/tags/*:refs/tags/*',
+        cwd=work)
+
+def make_fleet(dir, options):
+    """Creates origins, work clones and monitored clones"""
+    branches = ['master'] + ['branch%s' % b for b in range(1, options.branches)]
+    for r in range(options.repos):
+        origin = os.path.join(dir, 'origins', 'repo%s.git' % r)
+        work = os.path.join(dir, 'work', 'repo%s' % r)
+        git('init', '--quiet', '--bare', origin)
+        git('init', '--quiet', work)
+        git('remote', 'add', 'origin', origin, cwd=work)
+        fast_import(work, commit_stream(branches, 1, options.files, 0, 0))
+        push(work)
+        git('clone', '--quiet', origin, os.path.join(dir, 'clones', 'repo%s' % r))
+    return branches
+
+def write_config(dir, options):
+    conf = os.path.join(dir, 'gitmon.conf')
+    with open(conf, 'w') as f:
+        f.write('notifier.type = null\n')
+        f.write('notify.async = 0\n')
+        f.write('state.dir = %s\n' % os.path.join(dir, 'state'))
+        f.write('scan.fleet.path = %s\n' % os.path.join(dir, 'clones'))
+        f.write('scan.fleet.depth = 2\n')
+        f.write('check.parallelism = %s\n' % options.parallelism)
+        f.write('check.processes = %s\n' % options.processes)
+        f.write('max.new.commits = %s\n' % options.max_commits)
+        for line in options.config:
+            f.write('%s\n' % line)
+    return conf
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('--repos', type='int', default=20, help='number of repositories [20]')
+    parser.add_option('--branches', type='int', default=3, help='branches per repository [3]')
+    parser.add_option('--tags', type='int', default=1, help='new tags per repository per cycle [1]')
+    parser.add_option('--commits', type='int', default=2,
+                      help='new commits per branch per cycle [2]')
+    parser.add_option('--files', type='int', default=5, help='files changed per commit [5]')
+    parser.add_option('--cycles', type='int', default=3, help='check cycles with activity [3]')
+    parser.add_option('--idle', type='int', default=1, help='check cycles without activity [1]')
+    parser.add_option('--parallelism', type='int', default=1, help='check.parallelism [1]')
+    parser.add_option('--processes', type='int', default=1, help='check.processes [1]')
+    parser.add_option('--max-commits', type='int', default=5, help='max.new.commits [5]')
+    parser.add_option('--config', action='append', default=[],
+                      help='extra configuration line, e.g. --config "fetch.precheck = 1"')
+    parser.add_option('--keep', action='store_true', help='keep generated repositories')
+    options, args = parser.parse_args()
+
+    dir = tempfile.mkdtemp(prefix='gitmon-fleet-')
+    try:
+        started = time.time()
+        branches = make_fleet(dir, options)
+        print 'Created %s repositories in %.2fs (%s)' % (options.repos, time.time() - started, dir)
+        conf = write_config(dir, options)
+
+        started = time.time()
+        app = gitmon.Gitmon(conf)
+        print 'Discovery: %.3fs' % (time.time() - started)
+        timer = app.metrics = PhaseTimer()
+
+        print '%-6s %-8s %8s %8s %8s %8s %8s %8s %8s' % (('cycle', 'activity', 'total') +
+                                                        phases + ('updated',))
+        for cycle in range(1, options.cycles + options.idle + 1):
+            active = cycle <= options.cycles
+            if active:
+                for r in range(options.repos):
+                    work = os.path.join(dir, 'work', 'repo%s' % r)
+                    fast_import(work, commit_stream(branches, options.commits, options.files,
+                                                    cycle, options.tags))
+                    push(work)
+            timer.reset()
+            started = time.time()
+            updated = app.check()
+            total = time.time() - started
+            print '%-6s %-8s %7.3fs %s %8s' % (cycle, active and 'yes' or 'no', total,
+                    ' '.join(['%7.3fs' % timer.times[phase] for phase in phases]), len(updated))
+        app.close()
+    finally:
+        if options.keep:
+            print 'Kept repositories in %s' % dir
+        else:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# GitMon - The Git Repository Monitor
+# Copyright (C) 2010  Tomas Varaneckas
+# http://www.varaneckas.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures cold start time of the gitmon launcher, the way cron runs it:
+# 'gitmon --version' and a check of one up-to-date repository.
+#
+# usage: python bench/startup.py [runs]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+launcher = os.path.join(root, 'misc', 'gitmon')
+
+def git(*args, **kwargs):
+    subprocess.check_call(('git',) + args, stdout=open(os.devnull, 'w'),
+                          stderr=subprocess.STDOUT, **kwargs)
+
+def make_fixture(dir):
+    """Creates a local origin with one commit, a clone of it and a config
+    tracking the clone. Returns path to the config."""
+    origin = os.path.join(dir, 'origin.git')
+    clone = os.path.join(dir, 'clone')
+    work = os.path.join(dir, 'work')
+    git('init', '--bare', origin)
+    git('clone', origin, work)
+    open(os.path.join(work, 'README'), 'w').write('startup benchmark\n')
+    git('add', 'README', cwd=work)
+    git('-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+        'commit', '-m', 'initial', cwd=work)
+    git('push', 'origin', 'HEAD:master', cwd=work)
+    git('clone', origin, clone)
+    conf = os.path.join(dir, 'gitmon.conf')
+    with open(conf, 'w') as f:
+        f.write('notifier.type = command.line\n')
+        f.write('command.line.cmd = true\n')
+        f.write('state.dir = %s\n' % os.path.join(dir, 'state'))
+        f.write('repo.clone.path = %s\n' % clone)
+    return conf
+
+def measure(args, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(root, 'lib'), env.get('PYTHONPATH', '')])
+    times = []
+    for i in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, launcher] + args, env=env,
+                              stdout=open(os.devnull, 'w'))
+        times.append(time.time() - started)
+    times.sort()
+    return times[0], times[len(times) // 2], times[-1]
+
+def main():
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    dir = tempfile.mkdtemp(prefix='gitmon-bench-')
+    try:
+        conf = make_fixture(dir)
+        # first check creates state, it is not a cold start of a no-op check
+        measure(['-c', conf], 1)
+        print '%-20s %8s %8s %8s' % ('command', 'min', 'median', 'max')
+        for name, args in (('gitmon --version', ['--version']),
+                           ('gitmon (no-op check)', ['-c', conf])):
+            print '%-20s %7.3fs %7.3fs %7.3fs' % ((name,) + measure(args, runs))
+    finally:
+        shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main()
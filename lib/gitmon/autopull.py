@@ -0,0 +1,100 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import Queue
+import threading
+
+class PullQueue(object):
+    """Fast-forwards working trees of checked repositories in a few
+    background threads, so checking never waits for a checkout. Nothing is
+    fetched here, branches move to the upstream refs the check fetched."""
+
+    def __init__(self, workers=2, verbose=False):
+        self.workers = workers
+        self.verbose = verbose
+        self.queue = Queue.Queue()
+        self.pending = 0
+        #repositories that are queued or being pulled, by full path
+        self.queued = set()
+        self.cond = threading.Condition()
+        self.threads = []
+
+    def enqueue(self, repo):
+        """Queues a fast-forward of repo, unless one is already queued"""
+        with self.cond:
+            if repo.path_full in self.queued:
+                return
+            self.queued.add(repo.path_full)
+            self.pending += 1
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run,
+                                          name='gitmon-pull-%s' % len(self.threads))
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+        self.queue.put(repo)
+
+    def flush(self):
+        """Waits until all queued fast-forwards are done"""
+        with self.cond:
+            while self.pending:
+                self.cond.wait(1)
+
+    def run(self):
+        while True:
+            repo = self.queue.get()
+            try:
+                with repo.metrics.time('pull'):
+                    reason = fast_forward(repo)
+                if reason:
+                    repo.metrics.add('pulls_skipped')
+                    if self.verbose:
+                        print u'Not pulling repo: %s, %s' % (repo.name, reason)
+            except Exception as e:
+                if self.verbose:
+                    print u'Failed pulling repo: %s, %s' % (repo.name, e)
+            with self.cond:
+                self.queued.discard(repo.path_full)
+                self.pending -= 1
+                self.cond.notify_all()
+
+def fast_forward(repo):
+    """Moves the checked out branch of repo to its upstream when that is a
+    fast-forward. Returns the reason when the working tree is left alone,
+    None when it is up to date afterwards."""
+    git = repo.git
+    try:
+        branch = git('symbolic_ref', 'HEAD', q=True, short=True)
+    except Exception:
+        return 'HEAD is detached'
+    try:
+        upstream = git('rev_parse', '%s@{upstream}' % branch, symbolic_full_name=True)
+    except Exception:
+        return 'branch %s has no upstream' % branch
+    ahead, behind = [int(n) for n in
+                     git('rev_list', 'HEAD...%s' % upstream, left_right=True, count=True).split()]
+    if not behind:
+        return None
+    if ahead:
+        return 'branch has diverged from %s (%s local, %s remote commits)' % \
+            (upstream, ahead, behind)
+    if git('status', porcelain=True, untracked_files='no').strip():
+        return 'working tree has uncommitted changes'
+    git('merge', upstream, ff_only=True, quiet=True)
+    repo.metrics.add('pulls')
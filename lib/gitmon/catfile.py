@@ -0,0 +1,137 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+import subprocess
+
+class CommitInfo(object):
+    """Parsed header and message of a commit"""
+    __slots__ = ('hexsha', 'parents', 'committer_name', 'committed_date', 'message')
+
+    def __init__(self, hexsha, data):
+        self.hexsha = hexsha
+        self.parents = []
+        self.committer_name = ''
+        self.committed_date = 0
+        encoding = 'utf-8'
+        header, sep, message = data.partition('\n\n')
+        for line in header.split('\n'):
+            key, sep, value = line.partition(' ')
+            if key == 'parent':
+                self.parents.append(value)
+            elif key == 'committer':
+                # Name <email> timestamp timezone
+                person, sep, date = value.rpartition('> ')
+                self.committer_name = person.rpartition(' <')[0].decode(encoding, 'replace')
+                self.committed_date = int(date.split(' ')[0])
+            elif key == 'encoding':
+                encoding = value
+        try:
+            self.message = message.decode(encoding, 'replace')
+        except LookupError:
+            self.message = message.decode('utf-8', 'replace')
+
+class LRUCache(object):
+    """Dictionary that forgets least recently used entries beyond size"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tick = 0
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry:
+            self.tick += 1
+            entry[0] = self.tick
+            return entry[1]
+
+    def put(self, key, value):
+        self.tick += 1
+        self.entries[key] = [self.tick, value]
+        if len(self.entries) > self.size:
+            # forget the oldest quarter at once, so eviction stays cheap
+            ticks = sorted([entry[0] for entry in self.entries.values()])
+            oldest = ticks[len(ticks) // 4]
+            for key, entry in self.entries.items():
+                if entry[0] <= oldest:
+                    del self.entries[key]
+
+class ObjectReader(object):
+    """Reads objects of a repository through one long-lived
+    'git cat-file --batch' process, caching parsed commits by sha.
+    started is called whenever that process is started."""
+
+    def __init__(self, path, cache_size=512, started=None):
+        self.path = path
+        self.started = started
+        self.proc = None
+        self.lock = threading.Lock()
+        self.commits = LRUCache(cache_size)
+
+    def commit(self, rev):
+        """Returns CommitInfo of rev, peeling tags. Full shas of cached
+        commits are served without talking to git."""
+        with self.lock:
+            info = self.commits.get(rev)
+            if info:
+                return info
+            sha, type, data = self.read(rev)
+            while type == 'tag':
+                sha, type, data = self.read(data.split('\n', 1)[0].split(' ', 1)[1])
+            if type != 'commit':
+                raise ValueError('%s is a %s, not a commit' % (rev, type))
+            info = self.commits.get(sha)
+            if not info:
+                info = CommitInfo(sha, data)
+                self.commits.put(sha, info)
+            return info
+
+    def read(self, rev):
+        """Returns (sha, type, data) of object named rev"""
+        if not self.proc or self.proc.poll() is not None:
+            # without close_fds this long-lived process would keep pipes of git
+            # commands started by other threads open, and their readers would hang
+            self.proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.path,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         close_fds=True)
+            if self.started:
+                self.started()
+        try:
+            self.proc.stdin.write('%s\n' % rev)
+            self.proc.stdin.flush()
+            header = self.proc.stdout.readline().split()
+            if len(header) != 3:
+                raise ValueError('Object %s is missing' % rev)
+            data = self.proc.stdout.read(int(header[2]))
+            self.proc.stdout.read(1)
+        except (IOError, OSError):
+            self.close()
+            raise
+        return header[0], header[1], data
+
+    def close(self):
+        """Stops the cat-file process"""
+        proc, self.proc = self.proc, None
+        if proc:
+            try:
+                proc.stdin.close()
+                proc.wait()
+            except (IOError, OSError):
+                pass
@@ -0,0 +1,146 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import fnmatch
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class DirIndex(object):
+    """Remembers which directories are git repositories and which subdirectories
+    the others have. An entry is reused while directory mtime stays the same,
+    so unchanged subtrees cost one stat per directory instead of a listing."""
+
+    def __init__(self, path=None):
+        self.path = path
+        #dir -> [mtime, is repo, subdir names]
+        self.dirs = {}
+        self.visited = set()
+        self.changed = False
+
+    def load(self):
+        """Reads the index from self.path"""
+        if self.path and os.path.isfile(self.path):
+            with open(self.path) as index:
+                self.dirs = json.load(index)
+
+    def save(self):
+        """Writes the index to self.path, dropping directories that were
+        not visited by the last scans"""
+        for dir in self.dirs.keys():
+            if dir not in self.visited:
+                del self.dirs[dir]
+                self.changed = True
+        self.visited = set()
+        if not self.path or not self.changed:
+            return
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as index:
+            json.dump(self.dirs, index)
+        os.rename(tmp, self.path)
+        self.changed = False
+
+    def scan(self, root, depth, prune=()):
+        """Yields (name, path) of git repositories found under root, at most
+        depth levels deep. Subdirectories matching prune patterns are skipped."""
+        if not depth:
+            return
+        entry = self.lookup(root)
+        if not entry:
+            return
+        for name in entry[2]:
+            if [pattern for pattern in prune if fnmatch.fnmatch(name, pattern)]:
+                continue
+            dir = '%s/%s' % (root, name)
+            sub = self.lookup(dir)
+            if not sub:
+                continue
+            if sub[1]:
+                yield name, dir
+            else:
+                for repo in self.scan(dir, depth - 1, prune):
+                    yield repo
+
+    def walk(self, root, depth, prune=()):
+        """Yields root and the directories under it that scan looks at,
+        except git repositories"""
+        entry = self.lookup(root)
+        if not entry or entry[1]:
+            return
+        yield root
+        if not depth:
+            return
+        for name in entry[2]:
+            if [pattern for pattern in prune if fnmatch.fnmatch(name, pattern)]:
+                continue
+            for dir in self.walk('%s/%s' % (root, name), depth - 1, prune):
+                yield dir
+
+    def lookup(self, dir):
+        """Returns index entry of dir, listing it when it has changed"""
+        try:
+            mtime = os.stat(dir).st_mtime
+        except OSError:
+            return None
+        self.visited.add(dir)
+        entry = self.dirs.get(dir)
+        if entry and entry[0] == mtime:
+            return entry
+        is_repo, subdirs = list_dir(dir)
+        # a directory changed within the last seconds may change again
+        # without its mtime moving, so it must be listed next time too
+        if time.time() - mtime < 2:
+            mtime = None
+        entry = [mtime, is_repo, subdirs]
+        self.dirs[dir] = entry
+        self.changed = True
+        return entry
+
+def list_dir(dir):
+    """Returns (is git repo, subdirectory names) of dir"""
+    subdirs = []
+    try:
+        if scandir:
+            for item in scandir(dir):
+                if item.is_dir():
+                    if item.name == '.git':
+                        return True, []
+                    subdirs.append(item.name)
+        else:
+            for name in os.listdir(dir):
+                if os.path.isdir('%s/%s' % (dir, name)):
+                    if name == '.git':
+                        return True, []
+                    subdirs.append(name)
+    except OSError:
+        pass
+    return False, sorted(subdirs)
@@ -22,8 +22,28 @@ import os
 import re
 import time
 import shutil
+import zlib
+import socket
+import signal
+import pipes
+import threading
+import Queue
+import multiprocessing
+try:
+    import json
+except ImportError:
+    import simplejson as json
 from git import *
 from notifiers import *
+from refstate import RefStore
+from autopull import PullQueue
+from procloop import ProcessLoop
+from webhook import WebhookServer
+from watcher import Watcher, available as watch_available
+from discovery import DirIndex
+from scheduler import CheckScheduler
+from metrics import Metrics, null_metrics
+from catfile import ObjectReader
 
 #Should gitmon produce verbose output? Override with -v when running.
 verbose = False
@@ -33,8 +53,10 @@ debug = False
 notify_new_branch = 1
 #Should gitmon notify when new tag is created? Set in config
 notify_new_tag = 1
-#Should updates be pulled automatically?
+#Should updates be pulled automatically? Only fast-forwards are done.
 auto_pull = 0
+#How many working trees can be fast-forwarded at once?
+auto_pull_workers = 2
 #Should stale remote references be deleted and notified about?
 auto_delete_stale = 0
 #How many latest commits to display?
@@ -47,10 +69,79 @@ default_scan_depth = 3
 gitmon_dir = '.'
 #Notifier type
 notifier_type = 'command.line'
+#Port of the local push event listener of the daemon, 0 means no listener
+webhook_port = 0
+#Address the push event listener binds to
+webhook_address = '127.0.0.1'
+#Token or signing secret push events must carry, None accepts any event
+webhook_secret = None
+#Minutes between checks of each repository while push events are received
+webhook_poll = 60
+#Should the daemon watch refs of repositories and scanned roots with inotify?
+watch_local = 0
+#Should notifications be delivered from a background thread?
+notify_async = 1
+#Notifications arriving within this many seconds are merged into one. 0 disables.
+notify_coalesce = 0
 #Repository check delay in minutes
 check_delay = 5
 #use built-in scheduler
 scheduler_builtin = 0
+#Shortest delay between checks of a repository in minutes, check_delay when None
+check_min_delay = None
+#Longest delay between checks of a repository that has no updates, in minutes
+check_max_delay = 60
+#Random part of delay between checks, 0.1 means +-10%
+check_jitter = 0.1
+#Directory for gitmon's own state
+state_dir = '~/.gitmon.d'
+#Should last notified refs be kept in state_dir?
+ref_state = 1
+#Should directory listings of scanned roots be cached in state_dir?
+scan_cache = 1
+#How often should resident gitmon rescan roots for new repositories, in minutes
+scan_refresh = 60
+#What to fetch: full, blobless, treeless or depth:<commits>
+fetch_mode = 'full'
+#Should clones of the same remotes fetch from network only once per check?
+fetch_dedup = 1
+#Which remotes to watch, empty list means all remotes of the repository
+fetch_remotes = []
+#How many remotes of one repository are fetched in parallel
+fetch_jobs = 4
+#Should remote refs be listed before fetching, to skip fetch of unchanged repos?
+fetch_precheck = 0
+#Seconds an idle ssh connection shared by git commands stays open, 0 disables sharing
+ssh_control_persist = 600
+#ssh command sharing connections, see Gitmon.setup_ssh. None when not shared.
+ssh_command = None
+#Where to append JSON lines with per repository metrics of each check cycle
+metrics_log = None
+#Where to write Prometheus textfile collector file after each check cycle
+metrics_prometheus = None
+#How many repositories to check at the same time
+check_parallelism = 1
+#How many concurrent checks may hit a single remote host. 0 means unlimited.
+check_parallelism_per_host = 0
+#How many worker processes share the checks, 1 checks in this process
+check_processes = 1
+#How git commands of checks are run: gitpython (one thread per check) or
+#subprocess (git commands of all checks multiplexed on one thread)
+check_backend = 'gitpython'
+#Seconds after which network git commands (all git commands of checks with the
+#subprocess backend) are killed, 0 means never
+check_timeout = 0
+
+#defaults of globals set from configuration, see Gitmon.reset_globals
+config_defaults = dict([(name, globals()[name]) for name in (
+    'notify_new_branch', 'notify_new_tag', 'auto_pull', 'auto_pull_workers', 'max_new_commits',
+    'max_files_info', 'notifier_type', 'notify_async', 'notify_coalesce', 'auto_delete_stale',
+    'check_delay', 'check_min_delay', 'check_max_delay', 'check_jitter', 'scheduler_builtin',
+    'state_dir', 'ref_state', 'scan_cache', 'scan_refresh', 'fetch_mode', 'fetch_remotes',
+    'fetch_jobs', 'fetch_dedup', 'fetch_precheck', 'ssh_control_persist', 'metrics_log',
+    'metrics_prometheus', 'check_parallelism', 'webhook_port', 'webhook_address',
+    'webhook_secret', 'webhook_poll', 'watch_local', 'check_backend', 'check_timeout',
+    'check_processes', 'check_parallelism_per_host')])
 
 class Repository(object):
     """Works with GitPython's to produce nice status update information"""
@@ -64,127 +155,522 @@ class Repository(object):
             self.repo = Repo(self.path_full)
         except Exception as e:
             print 'Could not load repository at path: %s: %s' % (self.path_full, e)
+        #{ref: sha} map that was last notified about, None when unknown
+        self.known_refs = None
+        #{ref: sha} map seen by the last check
+        self.ref_snapshot = None
+        #timings and counters of the current check cycle
+        self.metrics = null_metrics
+        #all commit lookups go through this reader
+        self.objects = ObjectReader(self.path_full, started=self.count_git_process)
+        #one of fetch_mode values, set from repository configuration
+        self.fetch_mode = fetch_mode
+        #clone of the same remotes that has just fetched, see check_group
+        self.fetch_source = None
+        #names of remotes to watch, empty means all, set from configuration
+        self.remotes = fetch_remotes
+        #remotes watched by the current check, see get_remotes
+        self.watched = []
+        #should the next check compare local refs only, without fetching?
+        self.offline = False
+        #time when the last check of this repository finished
+        self.checked_at = 0
+        #delays between checks in minutes, see CheckScheduler
+        self.check_min = self.check_max = self.check_interval = check_delay
 
-    def check_status(self):
-        """Fetches remote heads and compares the received data to remote refs
-         stored in local git repo. Differences are returned as a list of
-         StatusUpdates
+    def get_options(self):
+        """Returns configured options and notified refs, see set_options"""
+        return {'fetch_mode': self.fetch_mode, 'remotes': self.remotes,
+                'known_refs': self.known_refs, 'offline': self.offline}
+
+    def set_options(self, options):
+        """Sets options returned by get_options of another Repository object"""
+        for key, value in options.items():
+            setattr(self, key, value)
+
+    def git(self, command, *args, **kwargs):
+        """Runs git command (a GitPython method name, like 'rev_list')
+        in the repository, counting the spawned process"""
+        self.count_git_process()
+        return getattr(self.repo.git, command)(*args, **kwargs)
 
-         FIXME: in future removal of tags and branches must also be displayed.
-         Local refs: repo.remotes.origin.refs
-         Remote refs:
-         fi = repo.remotes.origin.fetch()
-         check if fi[x].ref is not in local refs and notify. Perhaps delete
-         local ref to avoid notification reappearance.
+    def count_git_process(self):
+        self.metrics.add('git_processes')
 
+    def get_commit(self, sha):
+        """Returns CommitInfo of given sha, peeling tags"""
+        self.metrics.add('commits_read')
+        return self.objects.commit(sha)
+
+    def close(self):
+        """Stops git processes kept for this repository"""
+        self.objects.close()
+        if hasattr(self, 'repo'):
+            self.repo.git.clear_cache()
+
+    def get_remotes(self):
+        """Returns names of watched remotes that exist in the repository.
+        Remote sections without url (like promisor settings left by a
+        filtered fetch from a path) are not remotes to watch."""
+        names = [remote.name for remote in self.repo.remotes
+                 if remote.config_reader.has_option('url')]
+        if self.remotes:
+            names = [name for name in self.remotes if name in names]
+        return names
+
+    def get_remote_host(self):
+        """Returns host name of origin (or the first watched) remote, None for
+        local remotes"""
+        try:
+            names = self.get_remotes()
+            if 'origin' in names:
+                names.insert(0, 'origin')
+            return remote_host(self.repo.remote(names[0]).url)
+        except Exception:
+            return None
+
+    def get_remotes_key(self):
+        """Returns names and normalized urls of watched remotes, equal for all
+        clones watching the same remotes"""
+        try:
+            return tuple(sorted([(name, normalize_url(self.repo.remote(name).url, self.path_full))
+                                 for name in self.get_remotes()])) or None
+        except Exception:
+            return None
+
+    def check_status(self):
+        """Fetches watched remotes and compares {ref: sha} map of their
+         branches and of tags to the one that was last notified about (or to
+         the one stored locally before fetching, when nothing was notified yet).
+         Differences are returned as a list of BranchUpdates.
          """
-        updates = []
+        refs = self.start_check()
+        if not refs:
+            return
+        stored_refs, old_refs = refs
+        if self.offline:
+            return self.finish_check(old_refs, stored_refs)
+        with self.metrics.time('precheck'):
+            changed = not fetch_precheck or self.fetch_source or \
+                self.is_remote_changed(stored_refs)
+        if not changed:
+            if verbose:
+                print u'No changes in remote of repo: %s' % self.name
+            return self.finish_check(old_refs, stored_refs)
+        try:
+            with self.metrics.time('fetch'):
+                if self.metrics is null_metrics:
+                    self.fetch()
+                else:
+                    size = self.get_objects_size()
+                    self.fetch()
+                    self.metrics.add('fetch_bytes', self.get_objects_size() - size)
+        except GitCommandError as e:
+            if verbose:
+                print u'Failed checking for updates: %s' % self.path
+                dump(e)
+            return
+        return self.finish_check(old_refs)
+
+    def check_steps(self):
+        """Same check as check_status, split into steps for LoopChecker, which
+        runs git commands of many repositories at once. Yields steps:
+        ('run', git arguments) expects (returncode, output, error) of the
+        command back. ('stream', (git arguments, consumer)) does the same,
+        passing output to consumer as it arrives, see ProcessLoop.spawn.
+        ('call', steps) expects the value the steps are done with back.
+        Finally yields ('done', updates) like check_status. See CheckSteps."""
+        refs = yield ('call', self.start_check_steps())
+        if not refs:
+            yield ('done', None)
+            return
+        stored_refs, old_refs = refs
+        if self.offline:
+            updates = yield ('call', self.finish_check_steps(old_refs, stored_refs))
+            yield ('done', updates)
+            return
+        changed = True
+        if fetch_precheck and not self.fetch_source:
+            with self.metrics.time('precheck'):
+                for remote in self.watched:
+                    returncode, output, error = yield ('run', self.get_ls_remote_command(remote))
+                    if returncode:
+                        if verbose:
+                            print u'Failed listing remote refs of repo: %s, %s' % (self.name,
+                                                                                  error.strip())
+                        break
+                    advertised = parse_advertised(remote, output)
+                    if (yield ('call', self.advertised_changed_steps(stored_refs, remote,
+                                                                     advertised))):
+                        break
+                else:
+                    changed = False
+        if not changed:
+            if verbose:
+                print u'No changes in remote of repo: %s' % self.name
+            updates = yield ('call', self.finish_check_steps(old_refs, stored_refs))
+            yield ('done', updates)
+            return
+        with self.metrics.time('fetch'):
+            if self.metrics is not null_metrics:
+                size = yield ('call', self.objects_size_steps())
+            for command in self.get_fetch_commands():
+                returncode, output, error = yield ('run', command)
+                if returncode:
+                    break
+            if self.metrics is not null_metrics:
+                fetched = yield ('call', self.objects_size_steps())
+                self.metrics.add('fetch_bytes', fetched - size)
+        if returncode:
+            if verbose:
+                print u'Failed checking for updates: %s' % self.path
+                print error.strip()
+            yield ('done', None)
+            return
+        updates = yield ('call', self.finish_check_steps(old_refs))
+        yield ('done', updates)
+
+    def run_steps(self, steps):
+        """Runs steps (see check_steps) with blocking git commands, returns
+        the value they are done with"""
+        steps = CheckSteps(steps)
+        reply = None
+        while True:
+            kind, value = steps.send(reply)
+            if kind == 'done':
+                return value
+            if kind == 'stream':
+                reply = self.stream_git(*value)
+            else:
+                reply = self.git('execute', ['git'] + value, with_extended_output=True,
+                                 with_exceptions=False)
+
+    def stream_git(self, args, consumer):
+        """Runs git with args, passing its output to consumer as it arrives.
+        Returns (returncode, '', error)."""
+        replies = []
+        loop = ProcessLoop()
+        self.count_git_process()
+        loop.spawn(args, self.path_full, lambda *reply: replies.append(reply), consumer)
+        while not replies:
+            loop.step()
+        return replies[0]
+
+    def start_check(self):
+        """Finds watched remotes and returns ({ref: sha} stored locally,
+        {ref: sha} to compare with after fetching), None when there is
+        nothing to watch"""
+        return self.run_steps(self.start_check_steps())
+
+    def start_check_steps(self):
+        """Steps of start_check, see check_steps"""
         if verbose:
             print u'Checking repo: %s' % self.name
+        self.watched = self.get_remotes()
+        if not self.watched:
+            if verbose:
+                print u'No remotes to watch in repo: %s' % self.name
+            yield ('done', None)
+            return
+        stored_refs = yield ('call', self.stored_refs_steps())
+        old_refs = self.known_refs
+        if old_refs is None:
+            old_refs = stored_refs
+        yield ('done', (stored_refs, self.select_refs(old_refs)))
 
-        #get last commits in current remote ref
-        local_commits, remote_commits, local_refs, remote_refs = {}, [], [], []
-        for rem in self.repo.remotes.origin.refs:
-            try:
-                local_refs.append(rem.name)
-                local_commits[rem.remote_head] = rem.commit
-            except Exception as e:
-                if verbose:
-                    print u'Failed getting remote branch %s on repo %s: %s' % (rem.name,
-                                                                 self.name, e)
-        try:
-            #fetch new data
-            remote = self.repo.remotes.origin.fetch()
-            #check latest commits from remote
-            for fi in remote:
-                remote_refs.append(fi.ref)
-                if hasattr(fi.ref, 'remote_head'):
-                    branch = fi.ref.remote_head
-                else:
-                    if notify_new_tag and fi.ref.path.startswith('refs/tags/'):
-                        if not fi.ref.path in local_refs:
-                            up = BranchUpdates()
-                            up.set_new_tag(fi.ref.commit, fi.ref.name)
-                            updates.append(up)
-                    else:
-                        print u'warning, unknown ref type: %s' % fi.ref
-                        dump(fi.ref)
-                    continue
-                try: #http://byronimo.lighthouseapp.com/projects/51787-gitpython/tickets/44-remoteref-fails-when-there-is-character-in-the-name
-                    remote_commit = fi.commit
-                except Exception as e:
-                    dump(e)
+    def finish_check(self, old_refs, new_refs=None):
+        """Returns BranchUpdates between old_refs and new_refs, which are
+        read from the repository when not given"""
+        return self.run_steps(self.finish_check_steps(old_refs, new_refs))
+
+    def finish_check_steps(self, old_refs, new_refs=None):
+        """Steps of finish_check, see check_steps"""
+        updates = []
+        if new_refs is None:
+            new_refs = yield ('call', self.stored_refs_steps())
+        self.ref_snapshot = new_refs
+        if new_refs != old_refs:
+            with self.metrics.time('diff'):
+                updates = yield ('call', self.diff_refs_steps(old_refs, new_refs))
+                updates = self.filter_updates(updates)
+            with self.metrics.time('stats'):
+                yield ('call', self.collect_stats_steps(updates))
+        yield ('done', updates)
+
+    def fetch(self):
+        """Fetches new data from watched remotes, see get_fetch_commands"""
+        for command in self.get_fetch_commands():
+            self.git('execute', ['git'] + command, kill_after_timeout=check_timeout or None)
+
+    def get_fetch_commands(self):
+        """Returns git arguments of fetches of watched remotes, several remotes
+        in parallel with a single git fetch. Blobless and treeless modes make
+        this a partial clone, depth:N mode keeps it shallow. git refuses
+        --filter with several remotes, so partial clones fetch them one by
+        one, each becoming a promisor remote. When fetch_source is set, its
+        remote refs are copied locally instead, tags follow them. Such a
+        fetch from a path gets no --filter or --depth, which would make the
+        path a promisor remote of this repository."""
+        args = self.get_fetch_args()
+        command = self.get_ssh_args() + ['fetch']
+        if self.fetch_source:
+            args.pop('filter', None)
+            args.pop('depth', None)
+            remotes = [self.fetch_source.path_full] + \
+                ['+refs/remotes/%s/*:refs/remotes/%s/*' % (name, name) for name in self.watched]
+        elif len(self.watched) == 1:
+            remotes = self.watched
+        elif args.has_key('filter'):
+            options = command + self.repo.git.transform_kwargs(**args)
+            return [options + [name] for name in self.watched]
+        else:
+            args.update({'multiple': True, 'jobs': fetch_jobs})
+            remotes = self.watched
+        return [command + self.repo.git.transform_kwargs(**args) + remotes]
+
+    def get_fetch_args(self):
+        """Returns git fetch options for fetch_mode. With auto_delete_stale,
+        fetch also prunes stale remote branches in the same ref transaction
+        as the updates, removals are then reported by diff_refs_steps."""
+        args = {}
+        if auto_delete_stale:
+            args['prune'] = True
+        if self.fetch_mode == 'blobless':
+            args['filter'] = 'blob:none'
+        elif self.fetch_mode == 'treeless':
+            args['filter'] = 'tree:0'
+        elif self.fetch_mode.startswith('depth:'):
+            args['depth'] = int(self.fetch_mode[len('depth:'):])
+        return args
+
+    def get_objects_size(self):
+        """Returns size of loose and packed objects in bytes"""
+        return self.run_steps(self.objects_size_steps())
+
+    def objects_size_steps(self):
+        """Steps of get_objects_size, see check_steps"""
+        args = ['count-objects', '-v']
+        output = get_output(args, (yield ('run', args)))
+        size = 0
+        for line in output.splitlines():
+            key, value = line.split(':', 1)
+            if key in ('size', 'size-pack'):
+                size += int(value) * 1024
+        yield ('done', size)
+
+    def diff_refs_steps(self, old_refs, new_refs):
+        """Steps turning differences of two {ref: sha} maps into BranchUpdates,
+        see check_steps"""
+        updates = []
+        old_tips = [sha for name, sha in old_refs.items() if name.startswith('refs/remotes/')]
+        #notified commits can be gone after a force push and gc, or when the
+        #repository was cloned again, history must not be walked from them
+        present = yield ('call', self.present_commits_steps(old_tips))
+        old_tips = [sha for sha in old_tips if sha in present]
+        #new branches should only show commits that are not in known branches
+        known = old_tips + [sha for name, sha in new_refs.items()
+                            if name.startswith('refs/remotes/') and old_refs.has_key(name)]
+        seen_tips = set(old_tips)
+        for name, sha in sorted(new_refs.items()):
+            old_sha = old_refs.get(name)
+            if old_sha == sha:
+                continue
+            if name.startswith('refs/tags/'):
+                if notify_new_tag and not old_sha:
+                    up = BranchUpdates(ref=name)
+                    up.set_new_tag(self.get_commit(sha), name[len('refs/tags/'):])
+                    updates.append(up)
+                continue
+            if not old_sha and not notify_new_branch:
+                continue
+            if old_sha and not old_sha in present:
+                # walked like a new branch, cut at the other known branches
+                ups = yield ('call', self.updates_steps(None, sha,
+                                                        [tip for tip in known if tip != sha]))
+            else:
+                ups = yield ('call', self.updates_steps(old_sha, sha, known))
+            if ups or not old_sha:
+                up = BranchUpdates(self.get_branch_label(name), name, self.get_ref_remote(name))
+                if not old_sha:
+                    up.set_new_branch(self.get_commit(sha))
+                if not sha in seen_tips:
+                    up.add(ups)
+                    seen_tips.add(sha)
+                updates.append(up)
+        for name, sha in old_refs.items():
+            if name.startswith('refs/remotes/') and not new_refs.has_key(name):
+                if not sha in present:
+                    if verbose:
+                        print u'Removed branch %s is missing in repo: %s' % (name, self.name)
                     continue
-                if local_commits.has_key(branch) or notify_new_branch:
-                    if local_commits.has_key(branch):
-                        local_commit = local_commits[branch]
-                        new_branch = False
-                    else:
-                        local_commit = None
-                        new_branch = True
-                    ups = [update for update in self.get_updates(branch, local_commit, remote_commit)]
-                    if ups or new_branch:
-                        up = BranchUpdates(branch)
-                        if new_branch:
-                            up.set_new_branch(remote_commit)
-                        if not remote_commit in remote_commits and not remote_commit in local_commits.values():
-                            up.add(ups)
-                            remote_commits.append(remote_commit)
-                        updates.append(up)
-
-            if auto_pull:
+                up = BranchUpdates(self.get_branch_label(name), name, self.get_ref_remote(name))
                 try:
-                    self.repo.remotes.origin.pull()
+                    # XXX old commits may get lost within many updates even if branch was just removed
+                    up.set_removed(self.get_commit(sha))
                 except Exception as e:
                     if verbose:
-                        print u'Failed pulling repo: %s, %s' % (self.name, e)
-            # At this point we're done with checking for new additions, now let's check
-            # if anything was removed
+                        print u'Failed reading removed branch %s in repo: %s, %s' % (name,
+                                                                     self.name, e)
+                    continue
+                updates.append(up)
+        yield ('done', updates)
 
-            # It's possible to simply use self.repo.stale_refs for that, but it makes
-            # a remote call
-            if auto_delete_stale:
-                try:
-                    for ref in self.repo.remotes.origin.stale_refs:
-                        if hasattr(ref, 'remote_head'):
-                            if ref.remote_head == 'HEAD':
-                                continue
-                            name = ref.remote_head
-                        else:
-                            name = ref.name
-                        up = BranchUpdates(name)
-                        # XXX old commits may get lost within many updates even if branch/tag was just removed
-                        up.set_removed(ref.commit)
-                        updates.append(up)
-                        RemoteReference.delete(self.repo, ref)
-                except Exception as e:
-                    if verbose:
-                        print u'Failed cleaning up stale refs in repo: %s, %s' % (self.name, e)
-            updates = self.filter_updates(updates)
-            return updates
-        except AssertionError as e:
-            if verbose:
-                print u'Failed checking for updates: %s' % self.path
-                dump(e)
+    def is_remote_changed(self, stored):
+        """Compares refs advertised by watched remotes with the ones stored
+        locally. This costs a round-trip per remote and no local object work,
+        so an idle repository can be skipped without fetching."""
+        for remote in self.watched:
+            try:
+                advertised = self.get_advertised_refs(remote)
+            except Exception as e:
+                if verbose:
+                    print u'Failed listing remote refs of repo: %s, %s' % (self.name, e)
+                return True
+            if self.is_advertised_changed(stored, remote, advertised):
+                return True
+        return False
+
+    def is_advertised_changed(self, stored, remote, advertised):
+        """Compares refs advertised by remote with the ones stored locally.
+        Fetch only follows tags pointing at commits it has, so a new tag
+        whose peeled commit is not stored locally would not be fetched and
+        is no change."""
+        return self.run_steps(self.advertised_changed_steps(stored, remote, advertised))
 
-    def get_updates(self, branch, local, remote):
-        """Retrieves updates from remote branch if series of remote commits are newer than local. Limits to max_new_commits."""
-        depth = 0
-        while depth < max_new_commits:
-            depth += 1
-            if re.search('%s(~.*)?' % re.escape(branch), remote.name_rev) and self.is_remote_newer(local, remote):
-                yield Update(remote)
-            if remote.parents:
-                remote = remote.parents[0]
+    def advertised_changed_steps(self, stored, remote, advertised):
+        """Steps of is_advertised_changed, see check_steps"""
+        changed = False
+        new_tags = []
+        for name, sha in advertised.items():
+            if name.endswith('^{}') or stored.get(name) == sha:
+                continue
+            if name.startswith('refs/tags/') and not stored.has_key(name):
+                new_tags.append(advertised.get(name + '^{}', sha))
             else:
+                changed = True
                 break
+        if not changed and auto_delete_stale:
+            prefix = 'refs/remotes/%s/' % remote
+            for name in stored.keys():
+                if name.startswith(prefix) and not advertised.has_key(name):
+                    changed = True
+                    break
+        if not changed and new_tags:
+            present = yield ('call', self.present_commits_steps(new_tags))
+            changed = bool(present)
+        yield ('done', changed)
+
+    def get_advertised_refs(self, remote):
+        """Returns {ref: sha} of branches and tags remote advertises, see
+        parse_advertised"""
+        output = self.git('execute', ['git'] + self.get_ls_remote_command(remote),
+                          kill_after_timeout=check_timeout or None)
+        return parse_advertised(remote, output)
+
+    def get_ls_remote_command(self, remote):
+        return self.get_ssh_args() + ['ls-remote', '--heads', '--tags', remote]
+
+    def get_ssh_args(self):
+        """Returns git options making network commands use ssh_command,
+        unless the repository (or the user's git configuration) sets its own
+        core.sshCommand"""
+        if not ssh_command:
+            return []
+        config = self.repo.config_reader()
+        if config.has_section('core') and \
+                'sshcommand' in [name.lower() for name in config.options('core')]:
+            return []
+        return ['-c', 'core.sshCommand=%s' % ssh_command]
+
+    def stored_refs_steps(self):
+        """Steps returning {ref: sha} of branches of watched remotes and of
+        tags stored locally, see check_steps"""
+        refs = {}
+        heads = set(['refs/remotes/%s/HEAD' % name for name in self.watched])
+        patterns = ['refs/remotes/%s' % name for name in self.watched] + ['refs/tags']
+        args = ['for-each-ref', '--format=%(objectname) %(refname)'] + patterns
+        for line in get_output(args, (yield ('run', args))).splitlines():
+            sha, name = line.split(' ', 1)
+            if not name in heads:
+                refs[name] = sha
+        yield ('done', refs)
+
+    def select_refs(self, refs):
+        """Returns tags and branches of watched remotes from a {ref: sha} map"""
+        prefixes = tuple(['refs/remotes/%s/' % name for name in self.watched] + ['refs/tags/'])
+        selected = {}
+        for name, sha in refs.items():
+            if name.startswith(prefixes):
+                selected[name] = sha
+        return selected
 
-    def is_remote_newer(self, local, remote):
-        """Compares local and remote updates and tells if remote is newer."""
-        if local and local.hexsha == remote.hexsha:
-            return False
-        if not local or local.committed_date < remote.committed_date:
-            return True
+    def get_branch_label(self, name):
+        """Returns branch name of remote ref name, prefixed with the name of
+        the remote when several remotes are watched"""
+        remote = self.get_ref_remote(name)
+        if remote:
+            if len(self.watched) > 1:
+                return name[len('refs/remotes/'):]
+            return name[len('refs/remotes/%s/' % remote):]
+        return name[len('refs/remotes/'):]
+
+    def get_ref_remote(self, name):
+        """Returns the watched remote that remote ref name belongs to"""
+        for remote in self.watched:
+            if name.startswith('refs/remotes/%s/' % remote):
+                return remote
+
+    def present_commits_steps(self, shas):
+        """Steps returning the set of those of shas that are commits stored
+        locally, see check_steps. Missing ones are never downloaded from
+        promisor remotes of partial clones."""
+        if not shas:
+            yield ('done', set())
+            return
+        args = ['rev-list', '--no-walk', '--missing=allow-any', '--ignore-missing'] + \
+            list(set(shas))
+        yield ('done', set(get_output(args, (yield ('run', args))).split()))
+
+    def updates_steps(self, local, remote, known=()):
+        """Steps returning Updates of commits of remote branch sha that are not
+        reachable from local sha, following first parents, see check_steps.
+        When there is no local sha (new branch) history is cut at known shas
+        instead. Limits to max_new_commits."""
+        if local:
+            revs = ['%s..%s' % (local, remote)]
+        else:
+            revs = [remote, '--not'] + list(known)
+        args = ['rev-list', '--first-parent', '--max-count=%d' % max_new_commits] + revs
+        shas = get_output(args, (yield ('run', args))).split()
+        self.metrics.add('commits_walked', len(shas))
+        yield ('done', [Update(self.get_commit(sha)) for sha in shas])
+
+    def collect_stats_steps(self, updates):
+        """Steps filling in changed files of all commit updates with a single
+        git log call, see check_steps. Output is streamed so only
+        max_files_info files per commit are kept. Blobless repositories have
+        no file contents to count lines in, so only file names are listed,
+        and renames are not detected, as that would download blobs. Treeless
+        ones get no file information."""
+        pending = {}
+        for branch_updates in updates:
+            for update in branch_updates.updates:
+                if update.needs_stats:
+                    pending.setdefault(update.sha, []).append(update)
+        if not pending or self.fetch_mode == 'treeless':
+            yield ('done', None)
+            return
+        if self.fetch_mode == 'blobless':
+            stat = ['--name-only', '--no-renames']
+        else:
+            stat = ['--numstat']
+        args = ['log', '--no-walk=unsorted', '-m', '--first-parent'] + stat + \
+            ['--format=%x00%H'] + pending.keys()
+        reader = StatsReader(pending, self.fetch_mode != 'blobless')
+        returncode, output, error = yield ('stream', (args, reader))
+        if returncode and verbose:
+            print u'Failed collecting changed files in repo: %s, %s' % (self.name, error.strip())
+        yield ('done', None)
 
     def filter_updates(self, updates):
         """Filters updates to show only max_new_commits"""
@@ -192,7 +678,7 @@ class Repository(object):
         for update in updates:
             for commit in update.updates:
                 commits[commit] = update
-        commits_by_date = sorted(commits.keys(), key=lambda commit: commit.date, reverse=True)[:max_new_commits]
+        commits_by_date = sorted(commits.keys(), key=lambda commit: commit.timestamp, reverse=True)[:max_new_commits]
         filtered_updates = []
         for commit in commits_by_date:
             update = commits[commit]
@@ -206,15 +692,19 @@ class Repository(object):
 
 class BranchUpdates(object):
     """A set of commits that happened in a branch"""
-    def __init__(self, branch=None):
-        """Initializes branch updates object"""
+    __slots__ = ('branch', 'updates', 'type', 'ref', 'remote')
+
+    def __init__(self, branch=None, ref=None, remote=None):
+        """Initializes branch updates object of full ref name, which
+        belongs to remote unless it is a tag"""
         self.branch = branch
         self.updates = []
         self.type = ''
+        self.ref = ref
+        self.remote = remote
 
     def set_new_branch(self, commit):
         """Marks this update status as new branch"""
-        self.branch = self.branch
         self.type = ' (New branch)'
         self.updates.append(Update(commit, new_branch=True))
 
@@ -225,7 +715,7 @@ class BranchUpdates(object):
         self.updates.append(Update(commit, new_tag=True))
 
     def set_removed(self, commit):
-        """Marks this update as deleted in remote origin"""
+        """Marks this update as deleted in remote"""
         self.type = ' (Removed)'
         self.updates.append(Update(commit, deleted=True))
 
@@ -233,48 +723,127 @@ class BranchUpdates(object):
         """Appends an update to this update status"""
         self.updates.extend(update)
 
+    def __getstate__(self):
+        return (self.branch, self.updates, self.type, self.ref, self.remote)
+
+    def __setstate__(self, state):
+        self.branch, self.updates, self.type, self.ref, self.remote = state
+
     def __str__(self):
         """Creates a string representation of all updates in the branch"""
         return u'[%s]%s\n%s\n' % (self.branch, self.type, u'\n'.join([unicode(sta) for sta in self.updates]))
 
 class Update(object):
-    """Contains information about single commit"""
-    def __init__(self, commit, new_branch=False, new_tag=False, deleted=False):
-        self.files = []
-        if new_branch or new_tag or deleted:
-            self.date = time.strftime('%Y-%m-%d %H:%M:%S')
-            self.author = ''
-        else:
-            self.author = commit.committer.name.strip()
+    """Contains information about single commit. Only raw data is kept,
+    text is rendered when the update gets displayed."""
+    __slots__ = ('sha', 'timestamp', 'author', 'message', 'kind', 'files', 'files_count')
+
+    COMMIT, NEW_BRANCH, NEW_TAG, DELETED = range(4)
+    #names of kinds in reports
+    TYPES = ('commit', 'new_branch', 'new_tag', 'deleted')
 
-        self.date = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(commit.committed_date))
+    def __init__(self, commit, new_branch=False, new_tag=False, deleted=False):
+        self.sha = commit.hexsha
+        self.timestamp = commit.committed_date
+        #(insertions, deletions, path) of at most max_files_info files
+        self.files = ()
+        self.files_count = 0
+        self.author = None
+        self.message = None
         if new_branch:
-            self.message = 'New branch created'
+            self.kind = Update.NEW_BRANCH
         elif deleted:
-            self.message = 'This remote reference no longer appears in origin. It was removed locally.'
+            self.kind = Update.DELETED
+        elif new_tag:
+            self.kind = Update.NEW_TAG
+            self.message = commit.message
         else:
-            self.message = commit.message.strip()
-            if not new_tag:
-                self.files = ['[%s+ %s-] %s' % \
-                    (commit.stats.files[file]['insertions'], commit.stats.files[file]['deletions'], file) \
-                        for file in commit.stats.files.keys()]
+            #files are filled in later by Repository.collect_stats_steps
+            self.kind = Update.COMMIT
+            self.author = commit.committer_name
+            self.message = commit.message
+
+    @property
+    def needs_stats(self):
+        return self.kind == Update.COMMIT
+
+    def add_file(self, insertions, deletions, path):
+        """Adds a changed file, keeping only max_files_info of them"""
+        self.files_count += 1
+        if max_files_info <= 0 or len(self.files) < max_files_info:
+            #binary files have no line counts
+            if insertions == '-':
+                insertions, deletions = 0, 0
+            self.files += ((insertions, deletions, path),)
+
+    def __getstate__(self):
+        return tuple([getattr(self, name) for name in Update.__slots__])
+
+    def __setstate__(self, state):
+        for name, value in zip(Update.__slots__, state):
+            setattr(self, name, value)
+
+    def get_message(self):
+        if self.kind == Update.NEW_BRANCH:
+            return 'New branch created'
+        if self.kind == Update.DELETED:
+            return 'This remote reference no longer appears on the remote. It was removed locally.'
+        return self.message.strip()
 
     def __str__(self):
         """Displays update representation. It's used in notification later."""
+        date = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.timestamp))
         if self.author:
-            mess = '----------\n%s\n%s: %s' % (self.date, self.author, self.message)
+            mess = '----------\n%s\n%s: %s' % (date, self.author.strip(), self.get_message())
         else:
-            mess = '----------\n%s\n%s' % (self.date, self.message)
+            mess = '----------\n%s\n%s' % (date, self.get_message())
         if self.files:
+            files = self.files
             if max_files_info > 0:
-                mess += '\nFiles:\n%s' % '\n'.join(self.files[:max_files_info])
-                if len(self.files) > max_files_info:
-                    more_files = len(self.files) - max_files_info
-                    mess += '\n(%s more %s)' % (more_files, pluralize('file', more_files))
-            else:
-                mess += '\nFiles:\n%s' % '\n'.join(self.files)
+                files = files[:max_files_info]
+            mess += '\nFiles:\n%s' % '\n'.join([format_file(*file) for file in files])
+            if max_files_info > 0 and self.files_count > max_files_info:
+                more_files = self.files_count - max_files_info
+                mess += '\n(%s more %s)' % (more_files, pluralize('file', more_files))
         return mess
 
+class StatsReader(object):
+    """Reads git log output of Repository.collect_stats_steps as it arrives,
+    adding changed files to updates of their commits"""
+
+    def __init__(self, pending, numstat):
+        #updates by commit sha
+        self.pending = pending
+        #are lines --numstat ones, or --name-only?
+        self.numstat = numstat
+        self.current = []
+        #incomplete last line of the previous chunk
+        self.rest = ''
+
+    def __call__(self, data):
+        """Reads a chunk of output, '' marks its end"""
+        if data:
+            lines = (self.rest + data).split('\n')
+            self.rest = lines.pop()
+        else:
+            lines, self.rest = [self.rest], ''
+        for line in lines:
+            self.read_line(line)
+
+    def read_line(self, line):
+        if line.startswith('\0'):
+            self.current = self.pending.get(line[1:], [])
+        elif line:
+            if self.numstat:
+                fields = line.split('\t', 2)
+                if len(fields) != 3:
+                    return
+                insertions, deletions, path = fields
+            else:
+                insertions, deletions, path = None, None, line
+            for update in self.current:
+                update.add_file(insertions, deletions, path)
+
 class Gitmon(object):
     """Handles the big picture - config loading, checking for updates"""
 
@@ -290,10 +859,26 @@ class Gitmon(object):
         self.conf_file = os.path.expanduser(self.conf_file)
         if conf_file:
             self.conf_file = os.path.expanduser(conf_file)
+        self.ref_store = None
+        self.dispatcher = None
+        self.puller = None
+        self.shards = None
+        self.webhook = None
+        self.watcher = None
+        #repositories by normalized urls of their remotes, see on_push
+        self.url_index = {}
+        self.metrics = None
+        #repositories that can be reused when repos are reloaded, by full path
+        self.resident = {}
+        self.conf_mtime = self.get_conf_mtime()
         self.load_config()
+        self.setup_metrics()
+        self.setup_ssh()
+        self.dir_index = self.load_dir_index()
         self.load_repos()
         self.scan_repos()
         self.check_config()
+        self.load_ref_state()
         if debug:
             print 'Loaded config: %s' % self.config
 
@@ -335,6 +920,87 @@ PATH=/usr/bin:/usr/local/bin/:/bin
                         self.config[key] = re.sub("\$\{(.+)\}", self.config[par], val)
         self.set_globals()
 
+    def get_conf_mtime(self):
+        try:
+            return os.stat(self.conf_file).st_mtime
+        except OSError:
+            return None
+
+    def reload(self):
+        """Used when gitmon stays resident. Reloads configuration if its file
+        has changed and rescans roots every scan_refresh minutes. Repository
+        objects of paths that are still tracked are kept."""
+        mtime = self.get_conf_mtime()
+        if mtime == self.conf_mtime and time.time() - self.scanned_at < scan_refresh * 60:
+            return
+        if mtime != self.conf_mtime:
+            if verbose:
+                print 'Configuration changed, reloading %s' % self.conf_file
+            self.conf_mtime = mtime
+            self.config = {}
+            self.reset_globals()
+            self.load_config()
+            self.setup_metrics()
+            self.setup_ssh()
+            # workers were forked with the old configuration
+            self.close_shards()
+        self.resident = dict([(repo.path_full, repo) for repo in self.repos])
+        self.repos = []
+        self.load_repos()
+        self.scan_repos()
+        paths = set([repo.path_full for repo in self.repos])
+        for repo in self.repos:
+            if not self.resident.has_key(repo.path_full):
+                if verbose:
+                    print 'Started tracking repo: %s' % repo.name
+                if self.ref_store:
+                    repo.known_refs = self.ref_store.get(repo.path_full)
+        for path, repo in self.resident.items():
+            if not path in paths:
+                if verbose:
+                    print 'Stopped tracking repo: %s' % repo.name
+                repo.close()
+        self.resident = {}
+        if self.webhook:
+            self.index_urls()
+        self.update_watches()
+
+    def setup_metrics(self):
+        """Enables metrics when metrics.log or metrics.prometheus is set"""
+        if not metrics_log and not metrics_prometheus:
+            self.metrics = None
+        elif not self.metrics:
+            self.metrics = Metrics(metrics_log, metrics_prometheus)
+        else:
+            self.metrics.log, self.metrics.prometheus = metrics_log, metrics_prometheus
+
+    def setup_ssh(self):
+        """Sets ssh_command, which makes git commands share one ssh connection
+        per host, open for ssh_control_persist idle seconds with its socket in
+        state_dir/ssh. Checks of ssh remotes then skip the handshake. Not used
+        when the user sets GIT_SSH_COMMAND or GIT_SSH, see Repository.get_ssh_args."""
+        global ssh_command
+        ssh_command = None
+        if not ssh_control_persist or os.environ.get('GIT_SSH_COMMAND') or \
+                os.environ.get('GIT_SSH'):
+            return
+        dir = os.path.join(os.path.expanduser(state_dir), 'ssh')
+        # %C expands to 40 characters and socket paths are limited to 104 bytes
+        if len(dir) + 41 >= 104:
+            print 'Warning: ssh socket directory path is too long: %s' % dir
+            return
+        try:
+            if not os.path.isdir(dir):
+                os.makedirs(dir, 0700)
+            os.chmod(dir, 0700)
+        except OSError as e:
+            print 'Warning: could not create ssh socket directory %s: %s' % (dir, e)
+            return
+        ssh_command = 'ssh -o ControlMaster=auto -o %s -o ControlPersist=%d' % \
+            (pipes.quote('ControlPath=%s/%%C' % dir), ssh_control_persist)
+        if debug:
+            print 'Using ssh command: %s' % ssh_command
+
     def check_config(self):
         if not self.repos:
             print 'Your configuration file has no repositories. Make sure you have defined \
@@ -344,32 +1010,159 @@ repositories or scanned roots in your configuration. Refer to gitmon.conf.exampl
             if verbose:
                 print 'Configuration OK, tracking %s repositories' % len(self.repos)
 
+    def reset_globals(self):
+        """Sets global parameters back to their defaults, so options removed
+        from configuration do not keep their old values on reload"""
+        globals().update(config_defaults)
+
     def set_globals(self):
         """Sets global parameters from configuration"""
         global notify_new_branch, notify_new_tag, auto_pull, max_new_commits, max_files_info
+        global auto_pull_workers
         global notifier_type, auto_delete_stale, check_delay, scheduler_builtin
+        global check_parallelism, check_parallelism_per_host, fetch_precheck, check_processes
+        global check_backend, check_timeout
+        global webhook_port, webhook_address, webhook_secret, webhook_poll, watch_local
+        global state_dir, ref_state, scan_cache, scan_refresh, fetch_mode, fetch_dedup
+        global fetch_remotes, fetch_jobs
+        global check_min_delay, check_max_delay, check_jitter, ssh_control_persist
+        global notify_async, notify_coalesce, metrics_log, metrics_prometheus
         if self.config.has_key('notify.new.branch'):
             notify_new_branch = int(self.config['notify.new.branch'])
         if self.config.has_key('notify.new.tag'):
             notify_new_tag = int(self.config['notify.new.tag'])
         if self.config.has_key('auto.pull'):
             auto_pull = int(self.config['auto.pull'])
+        if self.config.has_key('auto.pull.workers'):
+            auto_pull_workers = max(1, int(self.config['auto.pull.workers']))
         if self.config.has_key('max.new.commits'):
             max_new_commits = int(self.config['max.new.commits'])
         if self.config.has_key('max.files.info'):
             max_files_info = int(self.config['max.files.info'])
         if self.config.has_key('notifier.type'):
             notifier_type = self.config['notifier.type']
+        if self.config.has_key('notify.async'):
+            notify_async = int(self.config['notify.async'])
+        if self.config.has_key('notify.coalesce.seconds'):
+            notify_coalesce = float(self.config['notify.coalesce.seconds'])
         if self.config.has_key('auto.delete.stale'):
             auto_delete_stale = int(self.config['auto.delete.stale'])
         if self.config.has_key('check.delay.minutes'):
             check_delay = int(self.config['check.delay.minutes'])
+        if self.config.has_key('check.min.minutes'):
+            check_min_delay = float(self.config['check.min.minutes'])
+        if self.config.has_key('check.max.minutes'):
+            check_max_delay = float(self.config['check.max.minutes'])
+        if self.config.has_key('check.jitter'):
+            check_jitter = float(self.config['check.jitter'])
         if self.config.has_key('scheduler.builtin'):
             scheduler_builtin = bool(int(self.config['scheduler.builtin']))
+        if self.config.has_key('state.dir'):
+            state_dir = self.config['state.dir']
+        if self.config.has_key('ref.state'):
+            ref_state = int(self.config['ref.state'])
+        if self.config.has_key('scan.cache'):
+            scan_cache = int(self.config['scan.cache'])
+        if self.config.has_key('scan.refresh.minutes'):
+            scan_refresh = int(self.config['scan.refresh.minutes'])
+        if self.config.has_key('fetch.mode'):
+            fetch_mode = self.config['fetch.mode']
+        if self.config.has_key('fetch.remotes'):
+            fetch_remotes = split_list(self.config['fetch.remotes'])
+        if self.config.has_key('fetch.jobs'):
+            fetch_jobs = max(1, int(self.config['fetch.jobs']))
+        if self.config.has_key('fetch.dedup'):
+            fetch_dedup = int(self.config['fetch.dedup'])
+        if self.config.has_key('fetch.precheck'):
+            fetch_precheck = int(self.config['fetch.precheck'])
+        if self.config.has_key('ssh.control.persist.seconds'):
+            ssh_control_persist = int(self.config['ssh.control.persist.seconds'])
+        if self.config.has_key('metrics.log'):
+            metrics_log = os.path.expanduser(self.config['metrics.log'])
+        if self.config.has_key('metrics.prometheus'):
+            metrics_prometheus = os.path.expanduser(self.config['metrics.prometheus'])
+        if self.config.has_key('check.parallelism'):
+            check_parallelism = max(1, int(self.config['check.parallelism']))
+        if self.config.has_key('webhook.port'):
+            webhook_port = int(self.config['webhook.port'])
+        if self.config.has_key('webhook.address'):
+            webhook_address = self.config['webhook.address']
+        if self.config.has_key('webhook.secret'):
+            webhook_secret = self.config['webhook.secret'] or None
+        if self.config.has_key('webhook.poll.minutes'):
+            webhook_poll = float(self.config['webhook.poll.minutes'])
+        if self.config.has_key('watch.local'):
+            watch_local = int(self.config['watch.local'])
+        if self.config.has_key('check.backend'):
+            check_backend = self.config['check.backend']
+            if not check_backend in ('gitpython', 'subprocess'):
+                print 'Warning: unknown check backend %s, using gitpython' % check_backend
+                check_backend = 'gitpython'
+        if self.config.has_key('check.timeout.seconds'):
+            check_timeout = float(self.config['check.timeout.seconds'])
+        if self.config.has_key('check.processes'):
+            check_processes = max(1, int(self.config['check.processes']))
+        if self.config.has_key('check.parallelism.per.host'):
+            check_parallelism_per_host = int(self.config['check.parallelism.per.host'])
+
+    def load_ref_state(self):
+        """Loads last notified refs of all repositories from state_dir"""
+        if not ref_state:
+            return
+        store = RefStore(os.path.join(os.path.expanduser(state_dir), 'refs.db'))
+        try:
+            store.load()
+        except Exception as e:
+            print 'Warning: could not load ref state from %s: %s' % (store.path, e)
+            return
+        self.ref_store = store
+        for repo in self.repos:
+            repo.known_refs = store.get(repo.path_full)
+
+    def save_ref_state(self):
+        """Writes refs of all checked repositories in a single batch"""
+        if self.ref_store:
+            try:
+                self.ref_store.save()
+            except Exception as e:
+                print 'Warning: could not save ref state to %s: %s' % (self.ref_store.path, e)
 
     def use_builtin_scheduler(self):
         return scheduler_builtin
 
+    def get_check_delay(self):
+        """Returns delay between checks in minutes"""
+        return check_delay
+
+    def create_scheduler(self):
+        """Returns scheduler for checking each repository when it is due"""
+        return CheckScheduler(check_jitter)
+
+    def set_repo_options(self, repo, prefix):
+        """Sets options of repo from <prefix>.fetch.mode, <prefix>.fetch.remotes,
+        <prefix>.check.min.minutes and <prefix>.check.max.minutes, falling back
+        to fetch.mode, fetch.remotes, check.min.minutes and check.max.minutes"""
+        repo.fetch_mode = self.config.get('%s.fetch.mode' % prefix, fetch_mode)
+        if not repo.fetch_mode in ('full', 'blobless', 'treeless') and \
+                not re.match(r'^depth:\d+$', repo.fetch_mode):
+            print 'Warning: unknown fetch mode %s of %s, using full' % (repo.fetch_mode, repo.name)
+            repo.fetch_mode = 'full'
+        repo.remotes = fetch_remotes
+        if self.config.has_key('%s.fetch.remotes' % prefix):
+            repo.remotes = split_list(self.config['%s.fetch.remotes' % prefix])
+        repo.check_min = check_min_delay
+        if repo.check_min is None:
+            repo.check_min = check_delay
+        repo.check_max = check_max_delay
+        if webhook_port:
+            # pushes are announced by push events, polling is only a safety net
+            repo.check_min = repo.check_max = webhook_poll
+        if self.config.has_key('%s.check.min.minutes' % prefix):
+            repo.check_min = float(self.config['%s.check.min.minutes' % prefix])
+        if self.config.has_key('%s.check.max.minutes' % prefix):
+            repo.check_max = float(self.config['%s.check.max.minutes' % prefix])
+        repo.check_max = max(repo.check_min, repo.check_max)
+
     def load_repos(self):
         """Loads repository definitions which are found in self.config"""
         for r in self.config.keys():
@@ -382,10 +1175,21 @@ repositories or scanned roots in your configuration. Refer to gitmon.conf.exampl
                 path = self.config['%s.path' % repo]
                 if verbose:
                     print 'Tracking repo: "%s" at %s' % (name, path)
-                self.repos.append(Repository(name, path))
+                repository = self.get_repository(name, path)
+                self.set_repo_options(repository, repo)
+                self.repos.append(repository)
 
-    def scan_repos(self):
-        """Scans provided dirs and recursively searches for repositories"""
+    def get_repository(self, name, path):
+        """Returns resident repository with given name and path, or opens it"""
+        repo = self.resident.get(os.path.expanduser(path))
+        if repo and repo.name == name:
+            return repo
+        return Repository(name, path)
+
+    def get_scan_roots(self):
+        """Returns (config prefix, name, dir, depth, prune patterns) of
+        scanned roots found in self.config"""
+        roots = []
         for root in self.config.keys():
             if root.startswith('scan.') and root.endswith('.path'):
                 root = root.replace('.path', '')
@@ -397,44 +1201,178 @@ repositories or scanned roots in your configuration. Refer to gitmon.conf.exampl
                     depth = int(self.config['%s.depth' % root])
                 else:
                     depth = default_scan_depth
+                prune = []
+                if self.config.has_key('%s.prune' % root):
+                    prune = split_list(self.config['%s.prune' % root])
                 dir = os.path.expanduser(self.config['%s.path' % root])
-                if verbose:
-                    print 'Scanning for repos in: %s' % dir
-                for repo in self.scan_dir_for_repos(dir, name, depth):
-                    self.repos.append(repo)
+                roots.append((root, name, dir, depth, prune))
+        return roots
 
-    def scan_dir_for_repos(self, root, root_name, depth):
-        """Scans directory recursively in serch of git repositories"""
-        if not depth:
-            return
-        for f in os.listdir(root):
-            dir = '%s/%s' % (root, f)
-            if os.path.isdir(dir):
-                if self.is_git_repo(dir):
-                    if verbose:
-                        print 'Found git repo: %s' % dir
-                    yield Repository('%s (%s)' % (f, root_name), dir)
-                else:
-                    for repo in self.scan_dir_for_repos(dir, root_name, depth - 1):
-                        yield repo
+    def scan_repos(self):
+        """Scans provided dirs and recursively searches for repositories"""
+        index = self.dir_index
+        self.scanned_at = time.time()
+        for root, name, dir, depth, prune in self.get_scan_roots():
+            if verbose:
+                print 'Scanning for repos in: %s' % dir
+            for repo in self.scan_dir_for_repos(index, dir, name, depth, prune):
+                self.set_repo_options(repo, root)
+                self.repos.append(repo)
+        try:
+            index.save()
+        except Exception as e:
+            print 'Warning: could not save directory index to %s: %s' % (index.path, e)
 
-    def is_git_repo(self, dir):
-        return '.git' in os.listdir(dir) and os.path.isdir(dir + '/.git')
+    def load_dir_index(self):
+        """Returns directory index, loaded from state_dir if scan_cache is on"""
+        if not scan_cache:
+            return DirIndex()
+        index = DirIndex(os.path.join(os.path.expanduser(state_dir), 'discovery.json'))
+        try:
+            index.load()
+        except Exception as e:
+            print 'Warning: could not load directory index from %s: %s' % (index.path, e)
+        return index
 
-    def check(self):
-        """Checks the repositories and displays notifications"""
-        for repo, st in self.get_repo_updates():
-            if st:
-                self.notify(repo, u'\n'.join([unicode(sta) for sta in st]))
+    def scan_dir_for_repos(self, index, root, root_name, depth, prune=()):
+        """Scans directory recursively in serch of git repositories"""
+        for f, dir in index.scan(root, depth, prune):
+            if verbose:
+                print 'Found git repo: %s' % dir
+            yield self.get_repository('%s (%s)' % (f, root_name), dir)
 
-    def get_repo_updates(self):
-        for repo in self.repos:
+    def rescan_roots(self, roots):
+        """Starts tracking repositories that appeared under given scanned
+        roots since they were scanned. Returns the roots that have
+        repositories which can not be opened yet, like unfinished clones."""
+        tracked = set([repo.path_full for repo in self.repos])
+        retry = set()
+        for root, name, dir, depth, prune in self.get_scan_roots():
+            if not root in roots:
+                continue
+            for f, path in self.dir_index.scan(dir, depth, prune):
+                if path in tracked:
+                    continue
+                repo = self.get_repository('%s (%s)' % (f, name), path)
+                if not hasattr(repo, 'repo'):
+                    retry.add(root)
+                    continue
+                if verbose:
+                    print 'Started tracking repo: %s' % repo.name
+                self.set_repo_options(repo, root)
+                if self.ref_store:
+                    repo.known_refs = self.ref_store.get(repo.path_full)
+                self.repos.append(repo)
+        return retry
+
+    def check(self, repos=None, report=None, remember=True):
+        """Checks the repositories (all by default) and displays notifications.
+        With report, a file, updates are written to it as JSON lines instead,
+        see get_report_records. Without remember, notified refs are neither
+        updated nor saved and nothing is pulled, so the same updates are
+        found again. Returns the repositories that had updates."""
+        updated = []
+        if repos is None:
+            repos = self.repos
+        for repo in repos:
+            if self.metrics:
+                repo.metrics = self.metrics.get(repo.name, repo.path_full)
+            else:
+                repo.metrics = null_metrics
+        for repo, st in self.get_repo_updates(repos):
+            if st and report:
+                with repo.metrics.time('format'):
+                    for record in get_report_records(repo, st):
+                        report.write('%s\n' % json.dumps(record, sort_keys=True))
+                    report.flush()
+                updated.append(repo)
+            elif st:
+                with repo.metrics.time('format'):
+                    message = u'\n'.join([unicode(sta) for sta in st])
+                self.notify(repo, message)
+                updated.append(repo)
+            repo.checked_at = time.time()
+            if not remember:
+                continue
+            # working trees only need a fast-forward when remote refs moved
+            moved = repo.ref_snapshot is not None and repo.ref_snapshot != repo.known_refs
+            self.remember_refs(repo)
+            if auto_pull and moved:
+                self.pull(repo)
+        if remember:
+            self.save_ref_state()
+        if self.metrics:
             try:
-                if hasattr(repo, 'repo'):
-                    yield (repo, repo.check_status())
+                self.metrics.write()
             except Exception as e:
+                print 'Warning: could not write metrics: %s' % e
+        return updated
+
+    def check_local(self, repos):
+        """Checks repos like check does, comparing refs stored locally to the
+        notified ones without fetching anything"""
+        for repo in repos:
+            repo.offline = True
+        try:
+            return self.check(repos)
+        finally:
+            for repo in repos:
+                repo.offline = False
+
+    def pull(self, repo):
+        """Queues a fast-forward of the working tree of repo, see PullQueue"""
+        if not self.puller:
+            self.puller = PullQueue(auto_pull_workers, verbose)
+        self.puller.workers = auto_pull_workers
+        self.puller.enqueue(repo)
+
+    def remember_refs(self, repo):
+        """Marks refs seen by the last check of repo as notified"""
+        if repo.ref_snapshot is None:
+            return
+        repo.known_refs = repo.ref_snapshot
+        if self.ref_store:
+            self.ref_store.set(repo.path_full, repo.ref_snapshot)
+
+    def get_repo_updates(self, repos=None):
+        """Yields (repo, updates) pairs, checking check_parallelism
+        repositories at a time"""
+        if repos is None:
+            repos = self.repos
+        repos = [repo for repo in repos if hasattr(repo, 'repo')]
+        groups = self.group_repos(repos)
+        if check_processes > 1 and len(groups) > 1:
+            if not self.shards:
+                self.shards = ShardPool(check_processes, self.metrics is not None)
+            results = self.shards.run(groups)
+        else:
+            results = check_groups(groups)
+        for repo, st, error in results:
+            if error:
                 if verbose:
-                    print 'Failed checking updates for %s: %s' % (repo.name, e)
+                    print 'Failed checking updates for %s: %s' % (repo.name, error)
+            else:
+                yield (repo, st)
+
+    def group_repos(self, repos):
+        """Groups clones of the same remotes when fetch_dedup is on. Partial
+        and shallow clones are not grouped, they can not serve objects they
+        lack to the others."""
+        if not fetch_dedup:
+            return [[repo] for repo in repos]
+        groups, by_remotes = [], {}
+        for repo in repos:
+            key = None
+            if repo.fetch_mode == 'full':
+                key = repo.get_remotes_key()
+            if key and by_remotes.has_key(key):
+                by_remotes[key].append(repo)
+            else:
+                group = [repo]
+                groups.append(group)
+                if key:
+                    by_remotes[key] = group
+        return groups
 
     def notify(self, repo, message):
         """Notifies user about status updates using given notifier.type
@@ -447,17 +1385,508 @@ repositories or scanned roots in your configuration. Refer to gitmon.conf.exampl
         if verbose:
             print 'Using notifier: %s' % notifier_type
             print 'Using notification icon: %s' % image
-        notifier.notify(title, message, image, repo.path_full)
+        if notify_async:
+            if not self.dispatcher:
+                self.dispatcher = NotificationDispatcher()
+            self.dispatcher.coalesce = notify_coalesce
+            self.dispatcher.dispatch(notifier, title, message, image, repo.path_full,
+                                     repo.metrics.time('notify'))
+        else:
+            with repo.metrics.time('notify'):
+                notifier.notify(title, message, image, repo.path_full)
+
+    def close(self):
+        """Delivers queued notifications, finishes queued pulls and stops
+        git processes of all repositories"""
+        self.flush_notifications()
+        if self.puller:
+            self.puller.flush()
+        self.close_shards()
+        if self.webhook:
+            self.webhook.close()
+            self.webhook = None
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+        for repo in self.repos:
+            repo.close()
+
+    def start_webhook(self, scheduler):
+        """Starts listening for push events when webhook.port is set. Each
+        event triggers a check of the matching repositories in scheduler."""
+        if not webhook_port:
+            return
+        self.scheduler = scheduler
+        self.index_urls()
+        try:
+            self.webhook = WebhookServer(webhook_address, webhook_port, self.on_push,
+                                         webhook_secret, verbose)
+        except socket.error as e:
+            print 'Could not listen for push events on %s:%s: %s' % (webhook_address,
+                                                                  webhook_port, e)
+            sys.exit(-1)
+        self.webhook.start()
+        if verbose:
+            print 'Listening for push events on %s:%s' % (webhook_address, webhook_port)
+
+    def index_urls(self):
+        """Indexes repositories by normalized urls of their watched remotes"""
+        index = {}
+        for repo in self.repos:
+            if hasattr(repo, 'repo'):
+                for name, url in repo.get_remotes_key() or ():
+                    index.setdefault(url, []).append(repo)
+        self.url_index = index
+
+    def on_push(self, urls, ref):
+        """Called by the webhook thread. Triggers checks of repositories
+        watching any of urls, returns how many there are."""
+        index = self.url_index
+        repos = {}
+        for url in urls:
+            for repo in index.get(normalize_url(url, os.getcwd()), []):
+                repos[repo.path_full] = repo
+        for repo in repos.values():
+            if verbose:
+                print u'Received push to %s of repo: %s' % (ref or 'unknown ref', repo.name)
+            self.scheduler.trigger(repo.path_full)
+        return len(repos)
+
+    def start_watcher(self, scheduler):
+        """Starts watching with inotify when watch.local is set. Refs changed
+        by fetches of someone else are then checked without network calls
+        and repositories cloned under scanned roots are tracked at once,
+        see take_local_changes. Changes wake up scheduler."""
+        if not watch_local:
+            return
+        if not watch_available():
+            print 'Warning: inotify is not available, ignoring watch.local'
+            return
+        self.watcher = Watcher(scheduler.wake)
+        self.update_watches()
+        if verbose:
+            print 'Watching refs of %s repositories' % len(self.repos)
+
+    def update_watches(self):
+        """Watches refs of tracked repositories and directories of scanned roots"""
+        if not self.watcher:
+            return
+        for repo in self.repos:
+            if hasattr(repo, 'repo'):
+                self.watcher.watch_repo(repo.path_full, repo.repo.git_dir)
+        self.watcher.unwatch_repos(set([repo.path_full for repo in self.repos]))
+        roots = self.get_scan_roots()
+        for root, name, dir, depth, prune in roots:
+            self.watcher.watch_dirs(root, list(self.dir_index.walk(dir, depth, prune)))
+        self.watcher.unwatch_roots(set([root[0] for root in roots]))
+
+    def take_local_changes(self):
+        """Tracks repositories that appeared under watched roots and returns
+        the ones whose refs changed after their last check"""
+        if not self.watcher:
+            return []
+        changed, roots = self.watcher.take()
+        if roots:
+            for root in self.rescan_roots(roots):
+                self.watcher.mark_root(root)
+            self.update_watches()
+        return [repo for repo in self.repos
+                if changed.get(repo.path_full, 0) > repo.checked_at]
+
+    def close_shards(self):
+        """Stops worker processes of check.processes"""
+        if self.shards:
+            self.shards.close()
+            self.shards = None
+
+    def flush_notifications(self):
+        """Waits until notifications queued by notify are delivered"""
+        if self.dispatcher:
+            self.dispatcher.flush()
 
     def selftest(self):
         print "GitMon Self Test. You should see a notification right now. Install Growl from http://growl.info if you don't."
         notifier = Notifier.create(notifier_type, self.config)
         notifier.notify('GitMon Test', 'It Works!', gitmon_dir + '/git.png', gitmon_dir)
 
+class CheckPool(object):
+    """Checks repositories in a bounded pool of worker threads. At most
+    per_host checks run against a single remote host at a time."""
+
+    def __init__(self, parallelism, per_host=0):
+        self.parallelism = parallelism
+        self.per_host = per_host
+
+    def run(self, groups):
+        """Checks groups of repositories (see check_group) and yields
+        (repo, updates, error) in the order checks finish"""
+        self.pending = [(group[0].get_remote_host(), group) for group in groups]
+        self.busy = {}
+        self.cond = threading.Condition()
+        self.results = Queue.Queue()
+        count = sum([len(group) for group in groups])
+        workers = []
+        for i in range(min(self.parallelism, len(groups))):
+            worker = threading.Thread(target=self.work, name='gitmon-check-%s' % i)
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        for i in range(count):
+            yield self.next_result()
+        for worker in workers:
+            worker.join()
+
+    def next_result(self):
+        """Waits for a finished check without blocking keyboard interrupts"""
+        while True:
+            try:
+                return self.results.get(True, 1)
+            except Queue.Empty:
+                pass
+
+    def take(self):
+        """Picks next group whose host has a free slot. Must be called
+        holding self.cond. Returns None when nothing can be taken now."""
+        for i, (host, group) in enumerate(self.pending):
+            if not host or not self.per_host or self.busy.get(host, 0) < self.per_host:
+                return self.pending.pop(i)
+
+    def work(self):
+        while True:
+            with self.cond:
+                item = self.take()
+                while not item:
+                    if not self.pending:
+                        return
+                    self.cond.wait()
+                    item = self.take()
+                host, group = item
+                self.busy[host] = self.busy.get(host, 0) + 1
+            results = check_group(group)
+            # the host slot is only needed until the first (network) fetch is done
+            self.results.put(results.next())
+            with self.cond:
+                self.busy[host] -= 1
+                self.cond.notify_all()
+            for result in results:
+                self.results.put(result)
+
+class ShardPool(object):
+    """Checks repositories in long-lived worker processes, so checking is
+    not limited by a single interpreter. Each group of repositories always
+    goes to the same worker, picked by a hash of its path, so workers keep
+    their Repository objects and git processes warm between checks. Results
+    are streamed back, notifications and state are handled by the caller."""
+
+    def __init__(self, processes, with_metrics=False):
+        self.processes = processes
+        self.with_metrics = with_metrics
+        self.results = multiprocessing.Queue()
+        self.workers = [None] * processes
+        self.tasks = [None] * processes
+
+    def start(self, shard):
+        self.tasks[shard] = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=run_shard, name='gitmon-shard-%s' % shard,
+                                         args=(self.tasks[shard], self.results, self.with_metrics))
+        worker.daemon = True
+        worker.start()
+        self.workers[shard] = worker
+
+    def run(self, groups):
+        """Checks groups of repositories (see check_group) in their workers and
+        yields (repo, updates, error) in the order checks finish"""
+        batches = [[] for i in range(self.processes)]
+        #repositories waiting for results, by full path
+        waiting = {}
+        for group in groups:
+            shard = get_shard(group[0].path_full, self.processes)
+            batches[shard].append([(repo.name, repo.path_full, repo.get_options())
+                                   for repo in group])
+            for repo in group:
+                waiting[repo.path_full] = (shard, repo)
+        for shard, batch in enumerate(batches):
+            if batch:
+                if not self.workers[shard] or not self.workers[shard].is_alive():
+                    self.start(shard)
+                self.tasks[shard].put(batch)
+        while waiting:
+            try:
+                path, st, snapshot, values, error = self.results.get(True, 1)
+            except Queue.Empty:
+                for path, (shard, repo) in waiting.items():
+                    if not self.workers[shard].is_alive():
+                        del waiting[path]
+                        yield (repo, None, 'worker process exited')
+                continue
+            if not waiting.has_key(path):
+                continue
+            repo = waiting.pop(path)[1]
+            repo.ref_snapshot = snapshot
+            for key, value in values.items():
+                repo.metrics.add(key, value)
+            yield (repo, st, error)
+
+    def close(self):
+        for shard, worker in enumerate(self.workers):
+            if worker and worker.is_alive():
+                self.tasks[shard].put(None)
+                worker.join(10)
+
+def get_shard(path, processes):
+    """Returns the worker that checks repository at path"""
+    return (zlib.crc32(path) & 0xffffffff) % processes
+
+def run_shard(tasks, results, with_metrics):
+    """Main loop of a ShardPool worker process. Reads batches of groups of
+    (name, path, options) and puts (path, updates, snapshot, metrics, error)
+    of every repository into results."""
+    # Ctrl+C reaches the whole process group, the parent stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    repos = {}
+    metrics = None
+    if with_metrics:
+        metrics = Metrics()
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        groups = []
+        for specs in batch:
+            group = []
+            for name, path, options in specs:
+                if not repos.has_key(path):
+                    repos[path] = Repository(name, path)
+                repo = repos[path]
+                repo.name = name
+                repo.set_options(options)
+                repo.metrics = metrics and metrics.get(name, path) or null_metrics
+                group.append(repo)
+            groups.append(group)
+        for repo, st, error in check_groups(groups):
+            values = {}
+            if metrics:
+                values = metrics.take(repo.path_full)
+            if error:
+                error = unicode(error)
+            results.put((repo.path_full, st, repo.ref_snapshot, values, error))
+    for repo in repos.values():
+        repo.close()
+
+class CheckSteps(object):
+    """Runs steps of Repository.check_steps, entering the steps they call.
+    Errors of called steps are raised in their callers."""
+
+    def __init__(self, steps):
+        #called steps, the innermost last
+        self.stack = [steps]
+
+    def send(self, reply):
+        """Sends reply to the current steps and returns the next 'run' or
+        'stream' step, or the final ('done', value)"""
+        error = None
+        while True:
+            try:
+                if error:
+                    step = self.stack[-1].throw(*error)
+                    error = None
+                else:
+                    step = self.stack[-1].send(reply)
+            except Exception:
+                self.stack.pop()
+                if not self.stack:
+                    raise
+                error = sys.exc_info()
+                continue
+            kind, value = step
+            if kind == 'call':
+                self.stack.append(value)
+                reply = None
+            elif kind == 'done' and len(self.stack) > 1:
+                self.stack.pop()
+                reply = value
+            else:
+                return step
+
+class LoopChecker(object):
+    """Checks repositories with check.backend = subprocess. Git commands
+    of up to inflight groups of repositories run at once, multiplexed by a
+    ProcessLoop on the calling thread, so only commit reads through
+    cat-file block it. Clones in a group are checked one after another, as
+    in check_group."""
+
+    def __init__(self, inflight, per_host=0, timeout=0):
+        self.inflight = inflight
+        self.per_host = per_host
+        self.timeout = timeout
+
+    def run(self, groups):
+        """Yields (repo, updates, error) in the order checks finish"""
+        self.loop = ProcessLoop(self.timeout)
+        self.pending = [(group[0].get_remote_host(), group) for group in groups]
+        self.busy = {}
+        self.active = 0
+        self.results = []
+        while self.pending or self.active or self.results:
+            while self.active < self.inflight:
+                item = self.take()
+                if not item:
+                    break
+                host, group = item
+                self.busy[host] = self.busy.get(host, 0) + 1
+                self.active += 1
+                self.start(host, group, 0, None)
+            self.loop.step()
+            while self.results:
+                yield self.results.pop(0)
+
+    def take(self):
+        """Picks next group whose host has a free slot"""
+        for i, (host, group) in enumerate(self.pending):
+            if not host or not self.per_host or self.busy.get(host, 0) < self.per_host:
+                return self.pending.pop(i)
+
+    def start(self, host, group, index, source):
+        """Starts checking group[index], fetching from source when set"""
+        repo = group[index]
+        repo.fetch_source = source
+        self.advance(host, group, index, CheckSteps(repo.check_steps()), None)
+
+    def advance(self, host, group, index, steps, reply):
+        """Runs check steps of group[index] until the next git command"""
+        repo = group[index]
+        source = repo.fetch_source
+        try:
+            kind, value = steps.send(reply)
+        except Exception as e:
+            kind, value = 'error', e
+        if kind in ('run', 'stream'):
+            args, consumer = value, None
+            if kind == 'stream':
+                args, consumer = value
+            repo.count_git_process()
+            self.loop.spawn(args, repo.path_full,
+                            lambda *reply: self.advance(host, group, index, steps, reply),
+                            consumer)
+            return
+        repo.fetch_source = None
+        if kind == 'done':
+            self.results.append((repo, value, None))
+            if not source and value is not None:
+                source = repo
+        else:
+            self.results.append((repo, None, value))
+        if index + 1 < len(group):
+            self.start(host, group, index + 1, source)
+        else:
+            self.busy[host] -= 1
+            self.active -= 1
+
+def check_groups(groups):
+    """Checks groups of repositories (see check_group), check_parallelism
+    groups at a time. Yields (repo, updates, error) as checks finish."""
+    if check_backend == 'subprocess':
+        return LoopChecker(check_parallelism, check_parallelism_per_host,
+                           check_timeout).run(groups)
+    if check_parallelism > 1 and len(groups) > 1:
+        return CheckPool(check_parallelism, check_parallelism_per_host).run(groups)
+    return (result for group in groups for result in check_group(group))
+
+def check_group(group):
+    """Checks clones of the same remotes, yielding (repo, updates, error).
+    Only the first clone that fetches successfully uses the network, the
+    others fetch from it locally."""
+    source = None
+    for repo in group:
+        repo.fetch_source = source
+        try:
+            result = (repo, repo.check_status(), None)
+            if not source and result[1] is not None:
+                source = repo
+        except Exception as e:
+            result = (repo, None, e)
+        repo.fetch_source = None
+        yield result
+
+def normalize_url(url, cwd):
+    """Returns url in a form that is equal for all spellings of the same
+    remote: scp-like urls become ssh:// ones, user names, trailing slashes and
+    .git are dropped, scheme and host are lowercased, local paths are resolved
+    relative to cwd."""
+    url = url.strip().rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-len('.git')]
+    match = re.match(r'^([\w+.-]+)://(?:[^@/]*@)?([^/]*)(.*)$', url)
+    if match:
+        scheme, host, path = match.groups()
+        if scheme.lower() == 'file':
+            return os.path.realpath(path)
+        return '%s://%s%s' % (scheme.lower(), host.lower(), path)
+    match = re.match(r'^(?:[^@/]*@)?([^/:]{2,}):(.*)$', url)
+    if match:
+        host, path = match.groups()
+        return 'ssh://%s/%s' % (host.lower(), path.lstrip('/'))
+    return os.path.realpath(os.path.join(cwd, url))
+
+def parse_advertised(remote, output):
+    """Returns {ref: sha} of branches and tags in ls-remote output of remote,
+    branches named the way they are stored locally. Commits annotated tags
+    point at are kept as <tag>^{}."""
+    refs = {}
+    for line in output.splitlines():
+        sha, name = line.split('\t', 1)
+        if name.startswith('refs/heads/'):
+            name = 'refs/remotes/%s/%s' % (remote, name[len('refs/heads/'):])
+        refs[name] = sha
+    return refs
+
+def get_output(args, reply):
+    """Returns output of git command args from its (returncode, output, error)
+    reply, raising GitCommandError when it failed"""
+    returncode, output, error = reply
+    if returncode:
+        raise GitCommandError(['git'] + args, returncode, error)
+    return output
+
+def split_list(value):
+    """Splits comma separated configuration value"""
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def remote_host(url):
+    """Extracts host name from remote url. Returns None for local paths."""
+    match = re.match(r'^[\w+.-]+://(?:[^@/]*@)?(\[[^\]]+\]|[^/:]*)', url)
+    if not match:
+        # scp-like syntax: [user@]host:path
+        match = re.match(r'^(?:[^@/]*@)?([^/:]{2,}):', url)
+    if match and match.group(1):
+        return match.group(1).lower()
+    return None
+
 def dump(obj):
     if debug:
         for attr in dir(obj):
             print 'obj.%s = %s' % (attr, getattr(obj, attr))
+
+def get_report_records(repo, updates):
+    """Yields a record of every update of repo, see Gitmon.check"""
+    for branch_updates in updates:
+        for update in branch_updates.updates:
+            numstat = []
+            for insertions, deletions, path in update.files:
+                if insertions is not None:
+                    insertions, deletions = int(insertions), int(deletions)
+                numstat.append([insertions, deletions, path])
+            yield {'repo': repo.name, 'path': repo.path_full, 'remote': branch_updates.remote,
+                   'ref': branch_updates.ref, 'type': Update.TYPES[update.kind],
+                   'sha': update.sha, 'author': update.author, 'timestamp': update.timestamp,
+                   'message': update.message and update.message.strip(),
+                   'numstat': numstat, 'files': update.files_count}
+
+def format_file(insertions, deletions, path):
+    if insertions is None:
+        return path
+    return '[%s+ %s-] %s' % (insertions, deletions, path)
+
 def pluralize(word, count):
     if count > 1:
         return '%ss' % word
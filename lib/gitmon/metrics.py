@@ -0,0 +1,169 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import time
+import threading
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullMetrics(object):
+    """Used when metrics are disabled, does nothing"""
+
+    timer = NullTimer()
+
+    def add(self, key, value=1):
+        pass
+
+    def time(self, phase):
+        return self.timer
+
+#shared by all repositories while metrics are disabled
+null_metrics = NullMetrics()
+
+class Timer(object):
+    """Adds time spent in a with block to <phase>_seconds"""
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.key = '%s_seconds' % phase
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.key, time.time() - self.started)
+        return False
+
+class RepoMetrics(object):
+    """Timings and counters of one repository in one check cycle"""
+
+    def __init__(self, collector, name, path):
+        self.collector = collector
+        self.name = name
+        self.path = path
+        self.values = {}
+
+    def add(self, key, value=1):
+        """Adds value to key in the current cycle. Values arriving after
+        the cycle was written (like background notifications and pulls)
+        land in the next one instead of being lost."""
+        with self.collector.lock:
+            current = self.collector.repos.get(self.path)
+            if not current:
+                current = RepoMetrics(self.collector, self.name, self.path)
+                self.collector.repos[self.path] = current
+            current.values[key] = current.values.get(key, 0) + value
+
+    def time(self, phase):
+        return Timer(self, phase)
+
+class Metrics(object):
+    """Collects RepoMetrics of a check cycle and writes them once per cycle
+    as JSON lines and as a Prometheus textfile collector file"""
+
+    def __init__(self, log=None, prometheus=None):
+        self.log = log
+        self.prometheus = prometheus
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.started = time.time()
+
+    def get(self, name, path):
+        """Returns metrics of repository for the current cycle"""
+        with self.lock:
+            if not self.repos.has_key(path):
+                self.repos[path] = RepoMetrics(self, name, path)
+            return self.repos[path]
+
+    def take(self, path):
+        """Removes metrics of repository at path, returns their values"""
+        with self.lock:
+            repo = self.repos.pop(path, None)
+        return repo and repo.values or {}
+
+    def write(self):
+        """Writes metrics collected since the last write and starts a new cycle"""
+        with self.lock:
+            repos, self.repos = self.repos, {}
+            started, self.started = self.started, time.time()
+        now = time.time()
+        cycle = {'time': now, 'cycle_seconds': now - started, 'repos': len(repos)}
+        if self.log:
+            make_parent(self.log)
+            with open(self.log, 'a') as log:
+                for repo in repos.values():
+                    record = {'time': now, 'repo': repo.name, 'path': repo.path}
+                    record.update(repo.values)
+                    log.write('%s\n' % json.dumps(record, sort_keys=True))
+                log.write('%s\n' % json.dumps(cycle, sort_keys=True))
+        if self.prometheus:
+            self.write_prometheus(repos.values(), cycle)
+
+    def write_prometheus(self, repos, cycle):
+        lines = ['# HELP gitmon_cycle_seconds Duration of the last check cycle',
+                 '# TYPE gitmon_cycle_seconds gauge',
+                 'gitmon_cycle_seconds %s' % cycle['cycle_seconds'],
+                 '# HELP gitmon_cycle_repos Repositories checked in the last cycle',
+                 '# TYPE gitmon_cycle_repos gauge',
+                 'gitmon_cycle_repos %s' % cycle['repos'],
+                 '# HELP gitmon_last_cycle_timestamp_seconds When the last cycle ended',
+                 '# TYPE gitmon_last_cycle_timestamp_seconds gauge',
+                 'gitmon_last_cycle_timestamp_seconds %s' % cycle['time']]
+        samples = {}
+        for repo in repos:
+            # names of scanned repositories are not unique, their paths are
+            repo_labels = 'repo="%s",path="%s"' % (escape(repo.name), escape(repo.path))
+            for key, value in repo.values.items():
+                if key.endswith('_seconds'):
+                    metric = 'gitmon_phase_seconds'
+                    labels = '%s,phase="%s"' % (repo_labels, key[:-len('_seconds')])
+                else:
+                    metric = 'gitmon_%s' % re.sub('[^a-zA-Z0-9_]', '_', key)
+                    labels = repo_labels
+                samples.setdefault(metric, []).append('%s{%s} %s' % (metric, labels, value))
+        for metric in sorted(samples.keys()):
+            lines.append('# TYPE %s gauge' % metric)
+            lines.extend(samples[metric])
+        make_parent(self.prometheus)
+        # textfile collectors may read any time, so the file is replaced atomically
+        tmp = '%s.tmp' % self.prometheus
+        with open(tmp, 'w') as prom:
+            prom.write('\n'.join(lines) + '\n')
+        os.rename(tmp, self.prometheus)
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def make_parent(path):
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
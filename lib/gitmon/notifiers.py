@@ -18,14 +18,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys
+import time
+import threading
+import Queue
 import subprocess
-if sys.platform.startswith('darwin') or sys.platform.startswith('win'):
-    import Growl
-else:
-    import pygtk
-    pygtk.require('2.0')
-    import pynotify
-    pynotify.init("GitMon")
 
 class Notifier(object):
 
@@ -37,30 +33,101 @@ class Notifier(object):
 
     @classmethod
     def create(cls, type, config):
-        """Returns singleton instance of given notifier type"""
+        """Returns singleton instance of given notifier type. GUI toolkits
+        are imported only when their notifier is created."""
         if type == 'command.line':
             return CommandLineNotifier.instance(config)
         if type == 'growl':
             return GrowlNotifier.instance(config)
         if type == 'libnotify':
             return LibnotifyNotifier.instance(config)
+        if type == 'null':
+            return Notifier(config)
+
+class NotificationDispatcher(object):
+    """Delivers notifications from a background thread, so checking never
+    waits for a notifier. Notifications that arrive within coalesce seconds
+    of the first one are merged into a single summary notification."""
+
+    def __init__(self, coalesce=0):
+        self.coalesce = coalesce
+        self.queue = Queue.Queue()
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def dispatch(self, notifier, title, message, image, cwd, timer=None):
+        """Queues a notification and returns immediately. Optional timer is
+        a context manager that is entered now and exited after delivery."""
+        if timer:
+            timer.__enter__()
+        with self.cond:
+            self.pending += 1
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name='gitmon-notify')
+                self.thread.setDaemon(True)
+                self.thread.start()
+        self.queue.put((notifier, title, message, image, cwd, timer))
+
+    def flush(self):
+        """Waits until all queued notifications are delivered"""
+        with self.cond:
+            while self.pending:
+                self.cond.wait(1)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.coalesce
+            while time.time() < deadline:
+                try:
+                    batch.append(self.queue.get(True, deadline - time.time()))
+                except Queue.Empty:
+                    break
+            try:
+                self.deliver(batch)
+            except Exception as e:
+                print 'Error while notifying: %s' % e
+            for item in batch:
+                if item[5]:
+                    item[5].__exit__(None, None, None)
+            with self.cond:
+                self.pending -= len(batch)
+                self.cond.notify_all()
+
+    def deliver(self, batch):
+        notifier, title, message, image, cwd, timer = batch[0]
+        if len(batch) > 1:
+            title = 'GitMon: %s repositories updated' % len(batch)
+            message = '\n\n'.join(['%s\n%s' % (item[1], item[2]) for item in batch])
+            cwd = None
+        notifier.notify(title, message, image, cwd)
 
 class LibnotifyNotifier(Notifier):
 
     inst = None
 
+    def __init__(self, config):
+        Notifier.__init__(self, config)
+        import pygtk
+        pygtk.require('2.0')
+        import pynotify
+        pynotify.init("GitMon")
+        self.pynotify = pynotify
+
     @classmethod
     def instance(cls, config):
         if not LibnotifyNotifier.inst:
             LibnotifyNotifier.inst = LibnotifyNotifier(config)
+        LibnotifyNotifier.inst.config = config
         return LibnotifyNotifier.inst
 
     def notify(self, title, message, image, cwd):
         if image:
             image = 'file://%s' % image
-            notification = pynotify.Notification(title, message, image)
+            notification = self.pynotify.Notification(title, message, image)
         else:
-            notification = pynotify.Notification(title, message)
+            notification = self.pynotify.Notification(title, message)
         if not notification.show():
             print "Failed showing python libnotify notification"
 
@@ -72,10 +139,15 @@ class CommandLineNotifier(Notifier):
     def instance(cls, config):
         if not CommandLineNotifier.inst:
             CommandLineNotifier.inst = CommandLineNotifier(config)
+        CommandLineNotifier.inst.config = config
         return CommandLineNotifier.inst
 
     def notify(self, title, message, image, cwd):
         notif_cmd = self.config['command.line.cmd'].split(' ')
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        if isinstance(title, unicode):
+            title = title.encode('utf-8')
         if '${message}' in notif_cmd:
             notif_cmd[notif_cmd.index('${message}')] = message
         if '${title}' in notif_cmd:
@@ -85,29 +157,51 @@ class CommandLineNotifier(Notifier):
         self.exec_notification(notif_cmd, cwd)
 
     def exec_notification(self, notif_cmd, path):
-        """Does the actual execution of notification command"""
-        proc = subprocess.Popen(notif_cmd, cwd=path, stdout=subprocess.PIPE)
+        """Does the actual execution of notification command, killing it
+        after notify.timeout.seconds"""
+        proc = subprocess.Popen(notif_cmd, cwd=path, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        timeout = float(self.config.get('notify.timeout.seconds', 30))
+        timer = None
+        if timeout > 0:
+            timer = threading.Timer(timeout, self.kill, (proc,))
+            timer.start()
         # usually error information comes out on stderr
         output, errdata = proc.communicate()
         retcode = proc.wait()
+        if timer:
+            timer.cancel()
         if retcode != 0:
             print 'Error while notifying: %s: %s' % (retcode, errdata)
 
+    def kill(self, proc):
+        print 'Notification command timed out, killing it'
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
 class GrowlNotifier(Notifier):
 
     inst = None
 
+    def __init__(self, config):
+        Notifier.__init__(self, config)
+        import Growl
+        self.Growl = Growl
+
     @classmethod
     def instance(cls, config):
         if not GrowlNotifier.inst:
             GrowlNotifier.inst = GrowlNotifier(config)
+        GrowlNotifier.inst.config = config
         return GrowlNotifier.inst
 
     def notify(self, title, message, image, cwd):
         if image:
-            image = Growl.Image.imageFromPath(image)
+            image = self.Growl.Image.imageFromPath(image)
         sticky = bool(int(self.config['growl.sticky.notifications']))
-        growl = Growl.GrowlNotifier(applicationName='GitMon', \
+        growl = self.Growl.GrowlNotifier(applicationName='GitMon', \
                 applicationIcon=image, \
                 notifications=['update'], \
                 defaultNotifications=['update'])
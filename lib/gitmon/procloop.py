@@ -0,0 +1,137 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import select
+import subprocess
+
+class GitProcess(object):
+    """A git process run by ProcessLoop. Its output is read in chunks
+    as it arrives, so a slow process never blocks the others. With a
+    consumer, output chunks are passed to it instead of being kept."""
+
+    def __init__(self, args, cwd, callback, timeout, consumer=None):
+        self.proc = subprocess.Popen(['git'] + list(args), cwd=cwd, close_fds=True,
+                                     stdin=open(os.devnull), stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+        self.callback = callback
+        self.consumer = consumer
+        self.stdout = self.proc.stdout.fileno()
+        self.chunks = {self.stdout: [], self.proc.stderr.fileno(): []}
+        #pipes that have not reached end of file yet
+        self.open = len(self.chunks)
+        self.deadline = None
+        if timeout:
+            self.deadline = time.time() + timeout
+        self.timed_out = False
+
+    def received(self, fd, data):
+        """Keeps data read from pipe fd, '' marks its end"""
+        if fd == self.stdout and self.consumer:
+            self.consumer(data)
+        elif data:
+            self.chunks[fd].append(data)
+
+    def finish(self):
+        """Waits for the exited process and calls back with
+        (returncode, output, error)"""
+        returncode = self.proc.wait()
+        output = ''.join(self.chunks[self.proc.stdout.fileno()])
+        error = ''.join(self.chunks[self.proc.stderr.fileno()])
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+        if self.timed_out:
+            error = 'timed out\n%s' % error
+        self.callback(returncode, output, error)
+
+class ProcessLoop(object):
+    """Runs any number of git processes at once on the calling thread,
+    multiplexing their pipes with poll (select where poll is missing).
+    Processes running longer than timeout seconds are killed."""
+
+    def __init__(self, timeout=0):
+        self.timeout = timeout
+        #running processes by file descriptors of their open pipes
+        self.pipes = {}
+        self.poller = None
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+
+    def spawn(self, args, cwd, callback, consumer=None):
+        """Starts git with args in cwd. callback gets (returncode, output, error)
+        from step() once the process exits. When consumer is given, it gets
+        output chunks as they are read and '' at the end, output is then
+        empty."""
+        process = GitProcess(args, cwd, callback, self.timeout, consumer)
+        for fd in process.chunks.keys():
+            self.pipes[fd] = process
+            if self.poller:
+                self.poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+    def running(self):
+        return len(set(self.pipes.values()))
+
+    def step(self, wait=1.0):
+        """Waits up to wait seconds for output, reads whatever arrived and
+        calls back for every process that has exited"""
+        if not self.pipes:
+            return
+        for fd in self.wait(wait):
+            process = self.pipes.get(fd)
+            if not process:
+                continue
+            data = os.read(fd, 65536)
+            process.received(fd, data)
+            if data:
+                continue
+            self.close_pipe(fd)
+            process.open -= 1
+            if not process.open:
+                process.finish()
+        self.kill_expired()
+
+    def wait(self, wait):
+        if self.poller:
+            return [fd for fd, event in self.poller.poll(wait * 1000)]
+        return select.select(self.pipes.keys(), [], [], wait)[0]
+
+    def close_pipe(self, fd):
+        del self.pipes[fd]
+        if self.poller:
+            self.poller.unregister(fd)
+
+    def kill_expired(self):
+        """Kills processes that are running past their deadline and finishes
+        them as failed. Their pipes are dropped at once, as children of git
+        (ssh, for one) may keep them open for a while."""
+        if not self.timeout:
+            return
+        now = time.time()
+        for process in set(self.pipes.values()):
+            if process.deadline < now:
+                process.timed_out = True
+                try:
+                    process.proc.kill()
+                except OSError:
+                    pass
+                for fd in process.chunks.keys():
+                    if self.pipes.get(fd) is process:
+                        self.close_pipe(fd)
+                process.finish()
@@ -0,0 +1,77 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sqlite3
+
+class RefStore(object):
+    """Keeps the last notified {ref: sha} map of every repository in a SQLite
+    database. All maps are read at once and changed ones are written back in
+    a single transaction."""
+
+    def __init__(self, path):
+        self.path = path
+        self.refs = {}
+        self.changed = {}
+
+    def load(self):
+        """Reads ref maps of all repositories"""
+        if not os.path.isfile(self.path):
+            return
+        conn = self.connect()
+        try:
+            for repo, ref, sha in conn.execute('SELECT repo, ref, sha FROM refs'):
+                self.refs.setdefault(repo, {})[ref] = sha
+        finally:
+            conn.close()
+
+    def get(self, repo):
+        """Returns stored ref map of given repository path or None"""
+        return self.refs.get(repo)
+
+    def set(self, repo, refs):
+        """Remembers ref map of given repository path until save()"""
+        if self.refs.get(repo) != refs:
+            self.refs[repo] = refs
+            self.changed[repo] = refs
+
+    def save(self):
+        """Writes all changed ref maps in a single transaction"""
+        if not self.changed:
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                for repo, refs in self.changed.items():
+                    conn.execute('DELETE FROM refs WHERE repo = ?', (repo,))
+                    conn.executemany('INSERT INTO refs (repo, ref, sha) VALUES (?, ?, ?)',
+                                     [(repo, ref, sha) for ref, sha in refs.items()])
+            self.changed = {}
+        finally:
+            conn.close()
+
+    def connect(self):
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.isdir(dir):
+            os.makedirs(dir)
+        conn = sqlite3.connect(self.path)
+        conn.text_factory = str
+        conn.execute('CREATE TABLE IF NOT EXISTS refs (repo TEXT, ref TEXT, sha TEXT, '
+                     'PRIMARY KEY (repo, ref))')
+        return conn
@@ -0,0 +1,126 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import heapq
+import random
+import threading
+
+class CheckScheduler(object):
+    """Priority queue of repositories ordered by the time of their next check.
+    Each repository waits check_min minutes after a check that found updates.
+    The wait doubles after every check without updates, up to check_max
+    minutes. Waits are randomly stretched or shrunk by jitter, so repositories
+    that were checked together drift apart. Other threads may trigger an
+    immediate check of a repository, waking up wait()."""
+
+    def __init__(self, jitter=0.1):
+        self.jitter = jitter
+        self.queue = []
+        #queue entries of scheduled repositories, by full path
+        self.scheduled = {}
+        #paths triggered while their repositories were being checked
+        self.triggered = set()
+        self.counter = 0
+        self.cond = threading.Condition()
+        #set by wake, makes the next wait return at once
+        self.woken = False
+
+    def sync(self, repos):
+        """Schedules an immediate check of repos that are not scheduled yet
+        and forgets the ones that are no longer in repos"""
+        current = dict([(repo.path_full, repo) for repo in repos])
+        with self.cond:
+            for path, entry in self.scheduled.items():
+                if current.get(path) is not entry[2]:
+                    del self.scheduled[path]
+            for path, repo in current.items():
+                if not self.scheduled.has_key(path):
+                    repo.check_interval = repo.check_min
+                    self.push(repo, time.time())
+
+    def push(self, repo, due):
+        """Schedules repo at due time, replacing its previous entry. Must
+        be called holding self.cond."""
+        self.counter += 1
+        entry = [due, self.counter, repo]
+        self.scheduled[repo.path_full] = entry
+        heapq.heappush(self.queue, entry)
+        self.cond.notify_all()
+
+    def pop_due(self):
+        """Removes and returns all repositories whose check is due"""
+        now = time.time()
+        due = []
+        with self.cond:
+            while self.queue and self.queue[0][0] <= now:
+                entry = heapq.heappop(self.queue)
+                repo = entry[2]
+                if self.scheduled.get(repo.path_full) is entry:
+                    del self.scheduled[repo.path_full]
+                    due.append(repo)
+        return due
+
+    def reschedule(self, repo, updated):
+        """Schedules next check of repo, sooner if the last one found updates"""
+        if updated:
+            repo.check_interval = repo.check_min
+        else:
+            repo.check_interval = min(repo.check_interval * 2, repo.check_max)
+        repo.check_interval = max(repo.check_interval, repo.check_min)
+        delay = repo.check_interval * 60 * random.uniform(1 - self.jitter, 1 + self.jitter)
+        with self.cond:
+            if repo.path_full in self.triggered:
+                self.triggered.discard(repo.path_full)
+                delay = 0
+            self.push(repo, time.time() + delay)
+
+    def trigger(self, path):
+        """Makes the check of repository at path due now. Safe to call from
+        any thread. A repository that is being checked is checked again as
+        soon as that check is done."""
+        with self.cond:
+            entry = self.scheduled.get(path)
+            if entry:
+                self.push(entry[2], time.time())
+            else:
+                self.triggered.add(path)
+
+    def wake(self):
+        """Makes wait return now, or at once when it is called next. Safe to
+        call from any thread."""
+        with self.cond:
+            self.woken = True
+            self.cond.notify_all()
+
+    def get_wait(self, limit):
+        """Returns seconds until the next due check, at most limit"""
+        with self.cond:
+            if not self.queue:
+                return limit
+            return max(0, min(limit, self.queue[0][0] - time.time()))
+
+    def wait(self, limit):
+        """Sleeps until the next check is due, a check is triggered, wake
+        is called or limit seconds pass"""
+        with self.cond:
+            wait = self.get_wait(limit)
+            if wait > 0 and not self.woken:
+                self.cond.wait(wait)
+            self.woken = False
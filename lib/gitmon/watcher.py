@@ -0,0 +1,237 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+#changes of ref files and of directories that hold them
+REFS_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+#new, moved or removed subdirectories of scanned directories
+DIRS_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+#files in the git directory that fetches rewrite
+GIT_DIR_FILES = ('packed-refs', 'FETCH_HEAD')
+
+class Inotify(object):
+    """Minimal ctypes binding of Linux inotify"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add(self, path, mask):
+        """Returns watch descriptor of path, -1 when it can not be watched"""
+        if isinstance(path, unicode):
+            # ctypes would pass unicode as wchar_t *
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        return self.libc.inotify_add_watch(self.fd, path, mask)
+
+    def remove(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Returns (wd, mask, name) of events that are ready"""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        pos = 0
+        while pos + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack('iIII', data[pos:pos + 16])
+            name = data[pos + 16:pos + 16 + length].rstrip('\0')
+            events.append((wd, mask, name))
+            pos += 16 + length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def available():
+    """Tells if inotify can be used here"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+        return hasattr(libc, 'inotify_init1')
+    except OSError:
+        return False
+
+class Watcher(object):
+    """Watches refs of repositories and directories of scan roots in a
+    background thread. Changes are collected until no event arrives for
+    settle seconds, then on_change() is called and take() returns them."""
+
+    def __init__(self, on_change, settle=1.0):
+        self.on_change = on_change
+        self.settle = settle
+        self.inotify = Inotify()
+        self.lock = threading.Lock()
+        #wd -> ('repo' or 'refs', repository path, dir) or ('root', root key, dir)
+        self.watches = {}
+        #watch descriptors by repository path and by scan root key
+        self.repo_watches = {}
+        self.root_watches = {}
+        #repository paths with the time of their last change, changed root keys
+        self.changed_repos = {}
+        self.changed_roots = set()
+        self.last_event = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='gitmon-watch')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def watch_repo(self, path, git_dir):
+        """Watches packed-refs, FETCH_HEAD and ref files of remote branches
+        and tags of repository at path"""
+        with self.lock:
+            if self.repo_watches.has_key(path):
+                return
+            wds = self.repo_watches[path] = []
+            self.add(wds, git_dir, IN_CLOSE_WRITE | IN_MOVED_TO, ('repo', path, git_dir))
+            for top in ('refs/remotes', 'refs/tags'):
+                for dir, subdirs, files in os.walk(os.path.join(git_dir, top)):
+                    self.add(wds, dir, REFS_MASK, ('refs', path, dir))
+
+    def unwatch_repos(self, paths):
+        """Stops watching repositories that are not in paths"""
+        with self.lock:
+            for path in self.repo_watches.keys():
+                if not path in paths:
+                    self.remove(self.repo_watches.pop(path))
+
+    def watch_dirs(self, key, dirs):
+        """Watches subdirectories of dirs, which belong to scan root key,
+        replacing dirs watched for it before"""
+        with self.lock:
+            self.remove(self.root_watches.pop(key, []))
+            wds = self.root_watches[key] = []
+            for dir in dirs:
+                self.add(wds, dir, DIRS_MASK, ('root', key, dir))
+
+    def unwatch_roots(self, keys):
+        """Stops watching directories of scan roots that are not in keys"""
+        with self.lock:
+            for key in self.root_watches.keys():
+                if not key in keys:
+                    self.remove(self.root_watches.pop(key))
+
+    def mark_root(self, key):
+        """Reports scan root key as changed again after settle seconds"""
+        with self.lock:
+            self.changed_roots.add(key)
+            self.last_event = time.time()
+
+    def add(self, wds, dir, mask, target):
+        wd = self.inotify.add(dir, mask)
+        if wd >= 0:
+            self.watches[wd] = target
+            wds.append(wd)
+
+    def remove(self, wds):
+        for wd in wds:
+            if self.watches.pop(wd, None):
+                self.inotify.remove(wd)
+
+    def take(self):
+        """Returns ({repository path: time of last change}, set of changed
+        scan root keys) collected since the last call"""
+        with self.lock:
+            repos, self.changed_repos = self.changed_repos, {}
+            roots, self.changed_roots = self.changed_roots, set()
+        return repos, roots
+
+    def run(self):
+        while not self.closed:
+            wait = 1.0
+            if self.last_event:
+                wait = max(0, self.last_event + self.settle - time.time())
+            try:
+                ready = select.select([self.inotify.fd], [], [], wait)[0]
+                events = ready and self.inotify.read() or []
+            except (OSError, select.error, ValueError):
+                if self.closed:
+                    break
+                raise
+            with self.lock:
+                for event in events:
+                    self.handle(*event)
+            if self.last_event and time.time() - self.last_event >= self.settle:
+                self.last_event = None
+                self.on_change()
+
+    def handle(self, wd, mask, name):
+        """Records an event, must be called holding self.lock"""
+        now = time.time()
+        if mask & IN_Q_OVERFLOW:
+            # events were lost, so everything may have changed
+            for kind, key, dir in self.watches.values():
+                if kind == 'root':
+                    self.changed_roots.add(key)
+                else:
+                    self.changed_repos[key] = now
+            self.last_event = now
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        target = self.watches.get(wd)
+        if not target:
+            return
+        kind, key, dir = target
+        if kind == 'root':
+            if mask & IN_ISDIR:
+                self.changed_roots.add(key)
+                self.last_event = now
+            return
+        if kind == 'repo' and not name in GIT_DIR_FILES:
+            return
+        if name.endswith('.lock'):
+            return
+        if kind == 'refs' and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # branch names with slashes live in subdirectories
+            self.add(self.repo_watches.setdefault(key, []), os.path.join(dir, name),
+                     REFS_MASK, ('refs', key, os.path.join(dir, name)))
+        self.changed_repos[key] = now
+        self.last_event = now
+
+    def close(self):
+        self.closed = True
+        self.inotify.close()
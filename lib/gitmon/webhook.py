@@ -0,0 +1,114 @@
+"""
+GitMon - The Git Repository Monitor
+Copyright (C) 2010  Tomas Varaneckas
+http://www.varaneckas.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hmac
+import hashlib
+import threading
+import BaseHTTPServer
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+#keys of repository objects in push payloads of common hosting services
+url_keys = ('url', 'clone_url', 'ssh_url', 'git_url', 'git_ssh_url', 'git_http_url', 'html_url')
+
+class WebhookServer(object):
+    """Accepts push events as JSON POST requests in a background thread.
+    A payload names the pushed repository with "url" or a "repository" that
+    is either an url or an object with urls (GitHub, GitLab and Gitea push
+    events are understood), and optionally the pushed "ref". on_push(urls,
+    ref) is called for each event and returns how many repositories it
+    matched. When secret is set, requests must carry it in the X-Gitmon-Token
+    header or sign the body with it (X-Hub-Signature-256, X-Gitlab-Token)."""
+
+    def __init__(self, address, port, on_push, secret=None, verbose=False):
+        self.on_push = on_push
+        self.secret = secret
+        self.verbose = verbose
+        self.server = BaseHTTPServer.HTTPServer((address, port), WebhookHandler)
+        self.server.webhook = self
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='gitmon-webhook')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def is_authorized(self, headers, body):
+        if not self.secret:
+            return True
+        for header in ('X-Gitmon-Token', 'X-Gitlab-Token'):
+            if headers.get(header) and hmac.compare_digest(headers.get(header), self.secret):
+                return True
+        signature = headers.get('X-Hub-Signature-256')
+        if signature:
+            digest = hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(signature, 'sha256=%s' % digest)
+        return False
+
+class WebhookHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return self.reply(400, 'Bad Content-Length')
+        body = self.rfile.read(length)
+        if not webhook.is_authorized(self.headers, body):
+            return self.reply(403, 'Forbidden')
+        try:
+            payload = json.loads(body)
+            urls = get_urls(payload)
+        except (ValueError, AttributeError):
+            return self.reply(400, 'Payload is not a JSON object')
+        if not urls:
+            return self.reply(400, 'Payload has no repository url')
+        matched = webhook.on_push(urls, payload.get('ref'))
+        if not matched:
+            return self.reply(404, 'No repository matches %s' % ', '.join(urls))
+        self.reply(202, 'Scheduled %s repositories' % matched)
+
+    def reply(self, code, message):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write('%s\n' % message)
+
+    def log_message(self, format, *args):
+        if self.server.webhook.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def get_urls(payload):
+    """Returns repository urls found in a push event payload"""
+    urls = []
+    if isinstance(payload.get('url'), basestring):
+        urls.append(payload['url'])
+    repository = payload.get('repository')
+    if isinstance(repository, basestring):
+        urls.append(repository)
+    elif isinstance(repository, dict):
+        urls.extend([repository[key] for key in url_keys
+                     if isinstance(repository.get(key), basestring)])
+    return urls